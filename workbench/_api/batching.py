@@ -0,0 +1,213 @@
+"""Cross-request micro-batching for local models.
+
+Requests that each need one short forward pass, like a line lens or a next
+token prediction, waste most of a GPU when they run one at a time. The
+batcher holds compatible requests for up to ``window`` seconds and runs
+them as a single padded trace through the scheduler. It then hands each
+caller its own slice of the results.
+
+Requests are compatible when they target the same model and the same batch
+function. A batch function takes a list of requests and the app state and
+returns one result per request, in order. A batch is sent as soon as one
+more request would push it over ``max_tokens`` padded tokens.
+"""
+
+import asyncio
+import os
+from typing import TYPE_CHECKING, Callable, Iterable, TypeVar
+
+from fastapi import HTTPException
+
+if TYPE_CHECKING:
+    from .scheduler import Scheduler
+
+R = TypeVar("R")
+T = TypeVar("T")
+
+# How long a request waits for others to share its forward pass, 0 turns batching off
+MICRO_BATCH_WINDOW_MS = float(os.environ.get("MICRO_BATCH_WINDOW_MS", "5"))
+
+# Padded tokens, rows times longest prompt, of one batched forward pass
+MICRO_BATCH_TOKENS = int(os.environ.get("MICRO_BATCH_TOKENS", "4096"))
+
+
+def prompt_length(state, model_name: str, text: str) -> int:
+    """Tokens ``text`` takes up in a batch."""
+    return len(state[model_name].tokenizer(text).input_ids)
+
+
+def check_positions(idxs: Iterable[int], length: int):
+    """Reject token positions outside a prompt of ``length`` tokens. In a
+    padded batch they would read another row's padding instead of failing."""
+    outside = sorted({idx for idx in idxs if not 0 <= idx < length})
+    if outside:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Token positions {outside} are outside the {length} token prompt",
+        )
+
+
+class BatchStats:
+    def __init__(self):
+        self.batches = 0
+        self.requests = 0
+        self.tokens = 0
+        self.padded_tokens = 0
+        self.max_size = 0
+        # Batches by number of requests
+        self.sizes: dict[int, int] = {}
+
+    def record(self, size: int, tokens: int, padded_tokens: int):
+        self.batches += 1
+        self.requests += size
+        self.tokens += tokens
+        self.padded_tokens += padded_tokens
+        self.max_size = max(self.max_size, size)
+        self.sizes[size] = self.sizes.get(size, 0) + 1
+
+    def to_dict(self) -> dict:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_size,
+            "batch_sizes": dict(sorted(self.sizes.items())),
+            # Share of each padded batch holding real tokens
+            "token_efficiency": (
+                self.tokens / self.padded_tokens if self.padded_tokens else 0.0
+            ),
+        }
+
+
+class PendingBatch:
+    """Requests collected for one batch function on one model."""
+
+    def __init__(self):
+        self.requests = []
+        self.lengths: list[int] = []
+        self.futures: list[asyncio.Future] = []
+
+    def padded_tokens(self, length: int = 0) -> int:
+        """Padded size of the batch, with one more request of ``length`` if given."""
+        rows = len(self.lengths) + (1 if length else 0)
+        return rows * max(self.lengths + [length])
+
+
+class MicroBatcher:
+    """Collects concurrent requests into batched jobs on the scheduler."""
+
+    def __init__(
+        self,
+        scheduler: "Scheduler",
+        window: float = MICRO_BATCH_WINDOW_MS / 1000,
+        max_tokens: int = MICRO_BATCH_TOKENS,
+    ):
+        self.scheduler = scheduler
+        self.window = window
+        self.max_tokens = max_tokens
+
+        self._pending: dict[tuple[str, Callable], PendingBatch] = {}
+        self._stats: dict[tuple[str, str], BatchStats] = {}
+        # The loop only keeps weak references to tasks
+        self._tasks: set[asyncio.Task] = set()
+
+    async def run(
+        self,
+        model_name: str,
+        fn: Callable[[list[R], object], list[T]],
+        req: R,
+        state,
+        length: int,
+    ) -> T:
+        """Run ``req`` in the next batch of ``fn`` on the model, once the
+        window closes or the batch is full, and return its result."""
+        key = (model_name, fn)
+        batch = self._pending.get(key)
+
+        if batch is not None and batch.padded_tokens(length) > self.max_tokens:
+            self._flush(key, batch, state)
+            batch = None
+
+        if batch is None:
+            batch = self._pending[key] = PendingBatch()
+            if self.window > 0:
+                asyncio.get_running_loop().call_later(
+                    self.window, self._flush, key, batch, state
+                )
+
+        future = asyncio.get_running_loop().create_future()
+        batch.requests.append(req)
+        batch.lengths.append(length)
+        batch.futures.append(future)
+
+        if self.window <= 0:
+            self._flush(key, batch, state)
+
+        return await future
+
+    def _flush(self, key: tuple[str, Callable], batch: PendingBatch, state):
+        # The batch may already have been sent for being full
+        if self._pending.get(key) is not batch:
+            return
+
+        del self._pending[key]
+        task = asyncio.create_task(self._run(key, batch, state))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: tuple[str, Callable], batch: PendingBatch, state):
+        model_name, fn = key
+        stats = self._stats.setdefault((model_name, fn.__name__), BatchStats())
+        stats.record(len(batch.requests), sum(batch.lengths), batch.padded_tokens())
+
+        try:
+            results = await self.scheduler.run(model_name, fn, batch.requests, state)
+        except Exception as e:
+            if len(batch.requests) == 1:
+                self._settle(batch.futures[0], exception=e)
+                return
+
+            # Retry each request alone so one bad request can't fail the others
+            await asyncio.gather(
+                *(
+                    self._run_alone(model_name, fn, req, future, state)
+                    for req, future in zip(batch.requests, batch.futures)
+                )
+            )
+            return
+
+        for future, result in zip(batch.futures, results):
+            self._settle(future, result=result)
+
+    async def _run_alone(self, model_name: str, fn: Callable, req, future, state):
+        if future.done():
+            return
+
+        try:
+            (result,) = await self.scheduler.run(model_name, fn, [req], state)
+        except Exception as e:
+            self._settle(future, exception=e)
+        else:
+            self._settle(future, result=result)
+
+    @staticmethod
+    def _settle(future: asyncio.Future, result=None, exception: Exception | None = None):
+        # Callers that gave up have cancelled their futures
+        if future.done():
+            return
+
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def stats(self) -> dict:
+        models: dict[str, dict] = {}
+        for (model_name, fn_name), stats in self._stats.items():
+            models.setdefault(model_name, {})[fn_name] = stats.to_dict()
+
+        return {
+            "window_ms": self.window * 1000,
+            "max_tokens": self.max_tokens,
+            "models": models,
+        }
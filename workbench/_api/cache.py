@@ -0,0 +1,186 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+def canonical_key(payload: dict) -> str:
+    """Hash a JSON-serializable payload independent of key order."""
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Thread-safe LRU of JSON-serializable results.
+
+    Entries are optionally mirrored to ``directory`` as one JSON file per key
+    so they survive restarts. Disk entries are read back on an in-memory miss.
+    The directory is its own LRU of at most ``max_disk_entries`` files, the
+    least recently used are deleted past that.
+
+    With ``max_bytes`` set, ``sizeof`` measures each entry and the least
+    recently used ones are evicted until the total fits.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        directory: str | None = None,
+        max_bytes: int | None = None,
+        sizeof: Callable[[Any], int] | None = None,
+        max_disk_entries: int | None = None,
+    ):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+
+        self._entries: OrderedDict[str, Any] = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        # Keys of the files in directory, least recently used first
+        self._disk_keys: OrderedDict[str, None] = OrderedDict()
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_disk_keys()
+
+    def _load_disk_keys(self):
+        paths = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                path = os.path.join(self.directory, name)
+                paths.append((os.path.getmtime(path), name[: -len(".json")]))
+
+        for _, key in sorted(paths):
+            self._disk_keys[key] = None
+
+        self._trim_disk()
+
+    def _touch_disk(self, key: str):
+        """Mark a key's file as used, deleting the oldest files past the cap."""
+        with self._lock:
+            self._disk_keys[key] = None
+            self._disk_keys.move_to_end(key)
+
+        self._trim_disk()
+
+    def _trim_disk(self):
+        if self.max_disk_entries is None:
+            return
+
+        with self._lock:
+            evicted = []
+            while len(self._disk_keys) > self.max_disk_entries:
+                key, _ = self._disk_keys.popitem(last=False)
+                evicted.append(key)
+
+        for key in evicted:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Failed to delete cache entry {key}: {e}")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        value = self._read(key)
+        if value is not None:
+            self._touch_disk(key)
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._insert(key, value)
+
+        return value
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._insert(key, value)
+
+        self._write(key, value)
+
+    def _insert(self, key: str, value: Any):
+        self.bytes -= self._sizes.pop(key, 0)
+
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+
+        if self.sizeof is not None:
+            self._sizes[key] = self.sizeof(value)
+            self.bytes += self._sizes[key]
+
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes is not None and self.bytes > self.max_bytes
+        ):
+            evicted, _ = self._entries.popitem(last=False)
+            self.bytes -= self._sizes.pop(evicted, 0)
+
+    def _read(self, key: str) -> Any | None:
+        if self.directory is None:
+            return None
+
+        try:
+            with open(self._path(key), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Failed to read cache entry {key}: {e}")
+            return None
+
+    def _write(self, key: str, value: Any):
+        if self.directory is None:
+            return
+
+        # Write to a temp file first so readers never see a partial entry
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry {key}: {e}")
+            return
+
+        self._touch_disk(key)
+
+    def stats(self) -> dict[str, int | float | None]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "disk_entries": len(self._disk_keys),
+                "max_disk_entries": self.max_disk_entries,
+            }
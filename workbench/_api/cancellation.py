@@ -0,0 +1,42 @@
+import threading
+from typing import Callable
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once its cancellation token is set."""
+
+
+class CancellationToken:
+    """Cooperative cancellation flag shared between a route and its worker thread."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: list[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback: Callable[[], None]):
+        """Call ``callback`` once the token is cancelled, right away if it already is."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+
+        callback()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise JobCancelled()
@@ -0,0 +1,76 @@
+"""Compact response encodings negotiated through the ``Accept`` header.
+
+Routes that support them build a dict of columns, parallel arrays and
+tensors instead of one pydantic object per cell, and ``encode_columns``
+serializes it as either:
+
+- ``application/vnd.workbench.columnar+json``: tensors become nested lists.
+- ``application/msgpack``: tensors become typed arrays
+  ``{"dtype", "shape", "data"}`` with little-endian raw bytes in ``data``.
+
+Clients that ask for neither get the regular JSON response models.
+"""
+
+import json
+
+import msgpack
+import torch as t
+from fastapi import Request, Response
+
+COLUMNAR_JSON = "application/vnd.workbench.columnar+json"
+MSGPACK = "application/msgpack"
+
+# Wire dtype for each tensor dtype, anything else goes out as float32
+TYPED_ARRAY_DTYPES = {
+    t.int32: t.int32,
+    t.int64: t.int32,
+    t.bool: t.uint8,
+}
+
+
+def supported_encodings() -> list[str]:
+    return [COLUMNAR_JSON, MSGPACK]
+
+
+def negotiate_encoding(request: Request) -> str | None:
+    """Dependency returning the first compact encoding the client accepts."""
+    supported = supported_encodings()
+
+    for media_range in request.headers.get("accept", "").split(","):
+        media_type = media_range.split(";")[0].strip().lower()
+        if media_type in ("application/x-msgpack", MSGPACK):
+            media_type = MSGPACK
+
+        if media_type in supported:
+            return media_type
+
+    return None
+
+
+def typed_array(tensor: t.Tensor) -> dict:
+    tensor = tensor.detach().cpu()
+    tensor = tensor.to(TYPED_ARRAY_DTYPES.get(tensor.dtype, t.float32)).contiguous()
+
+    return {
+        "dtype": str(tensor.dtype).removeprefix("torch."),
+        "shape": list(tensor.shape),
+        "data": tensor.numpy().tobytes(),
+    }
+
+
+def encode_columns(columns: dict, media_type: str) -> Response:
+    def convert(value):
+        if isinstance(value, t.Tensor):
+            return typed_array(value) if media_type == MSGPACK else value.tolist()
+        if isinstance(value, dict):
+            return {key: convert(item) for key, item in value.items()}
+        return value
+
+    payload = convert(columns)
+
+    if media_type == MSGPACK:
+        return Response(msgpack.packb(payload), media_type=MSGPACK)
+
+    return Response(
+        json.dumps(payload, separators=(",", ":")), media_type=COLUMNAR_JSON
+    )
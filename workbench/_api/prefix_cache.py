@@ -0,0 +1,209 @@
+import os
+import threading
+from collections import OrderedDict
+
+import torch as t
+from transformers import DynamicCache
+
+# One (keys, values) pair per layer, each [batch, heads, seq, head_dim]
+KV = tuple[tuple[t.Tensor, t.Tensor], ...]
+
+
+# Memory for each local model's prompt KV caches, 0 turns them off
+PREFIX_CACHE_BYTES = int(os.environ.get("PREFIX_CACHE_BYTES", str(256 * 2**20)))
+
+
+def cache_tensors(cache) -> KV | None:
+    """Per-layer (keys, values) of a ``DynamicCache``, or None when this
+    transformers version exposes neither the per-layer nor the legacy API."""
+    if hasattr(cache, "layers"):
+        if any(getattr(layer, "keys", None) is None for layer in cache.layers):
+            return None
+        return tuple((layer.keys, layer.values) for layer in cache.layers)
+
+    if hasattr(cache, "to_legacy_cache"):
+        return tuple(cache.to_legacy_cache())
+
+    return None
+
+
+def build_cache(kv: KV) -> DynamicCache:
+    """A new ``DynamicCache`` holding ``kv``, one (keys, values) pair per layer."""
+    cache = DynamicCache()
+    for layer_idx, (keys, values) in enumerate(kv):
+        cache.update(keys, values, layer_idx)
+    return cache
+
+
+def supports_cache_api() -> bool:
+    """Whether KV caches can be read out of and built into a ``DynamicCache``."""
+    cache = DynamicCache()
+    return hasattr(cache, "layers") or hasattr(cache, "to_legacy_cache")
+
+
+def supports_prefix_cache(config) -> bool:
+    """Prefixes of a sliding window cache aren't the cache of the prefix."""
+    layer_types = getattr(config, "layer_types", None) or []
+    return all(layer_type == "full_attention" for layer_type in layer_types)
+
+
+def make_prefix_cache(model) -> "PrefixCache | None":
+    if (
+        PREFIX_CACHE_BYTES <= 0
+        or not supports_cache_api()
+        or not supports_prefix_cache(model.config)
+    ):
+        return None
+
+    return PrefixCache(PREFIX_CACHE_BYTES)
+
+
+class _Node:
+    __slots__ = ("children", "keys", "key")
+
+    def __init__(self):
+        self.children: dict[int, _Node] = {}
+        # Every entry whose ids pass through this node
+        self.keys: set[tuple[int, ...]] = set()
+        # The entry ending here, if any
+        self.key: tuple[int, ...] | None = None
+
+
+class PrefixCache:
+    """Thread-safe LRU of prompt KV caches, indexed by token id prefix.
+
+    A lookup finds the longest prefix a new prompt shares with any cached
+    prompt. Only the tokens past it need a forward pass. Entries are evicted
+    least recently used first once their tensors exceed ``max_bytes``. A
+    cached prompt that is a prefix of a newer one is dropped, since the newer
+    entry covers it.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+
+        self._root = _Node()
+        self._entries: OrderedDict[tuple[int, ...], KV] = OrderedDict()
+        self._sizes: dict[tuple[int, ...], int] = {}
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self.computed_tokens = 0
+
+    def lookup(self, ids: list[int], limit: int) -> tuple[int, DynamicCache]:
+        """Longest cached prefix of ``ids``, at most ``limit`` tokens long.
+
+        Returns its length and a new cache holding it, empty on a miss. The
+        cache can be handed to the model, which extends it without touching
+        the stored entry.
+        """
+        with self._lock:
+            node, length = self._root, 0
+            for id in ids[:limit]:
+                if id not in node.children:
+                    break
+                node, length = node.children[id], length + 1
+
+            self.computed_tokens += len(ids) - length
+            if length == 0:
+                self.misses += 1
+                return 0, DynamicCache()
+
+            key = next(iter(node.keys))
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.reused_tokens += length
+
+            kv = self._entries[key]
+
+        return length, build_cache(
+            tuple((keys[:, :, :length], values[:, :, :length]) for keys, values in kv)
+        )
+
+    def put(self, ids: list[int], cache: DynamicCache):
+        """Store the KV cache of ``ids``. Extra positions in ``cache``, like
+        generated tokens, are cropped off."""
+        layers = cache_tensors(cache)
+        if layers is None:
+            return
+
+        key = tuple(ids)
+        # Cloned so a cropped slice doesn't keep the whole cache's storage
+        # alive, and the byte budget counts what is actually held
+        kv = tuple(
+            (
+                keys[:, :, : len(key)].detach().clone(),
+                values[:, :, : len(key)].detach().clone(),
+            )
+            for keys, values in layers
+        )
+        size = sum(keys.nbytes + values.nbytes for keys, values in kv)
+
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            # Entries for prefixes of these ids, including the ids themselves
+            prefixes = []
+            node = self._root
+            for id in key:
+                node = node.children.get(id)
+                if node is None:
+                    break
+                if node.key is not None:
+                    prefixes.append(node.key)
+            else:
+                if node.keys and node.key is None:
+                    # Already covered by a longer prompt
+                    self._entries.move_to_end(next(iter(node.keys)))
+                    return
+
+            for prefix in prefixes:
+                self._remove(prefix)
+
+            self._entries[key] = kv
+            self._sizes[key] = size
+            self.bytes += size
+            self._index(key)
+
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _index(self, key: tuple[int, ...]):
+        node = self._root
+        for id in key:
+            node = node.children.setdefault(id, _Node())
+            node.keys.add(key)
+        node.key = key
+
+    def _remove(self, key: tuple[int, ...]):
+        del self._entries[key]
+        self.bytes -= self._sizes.pop(key)
+
+        node = self._root
+        for id in key:
+            child = node.children[id]
+            child.keys.discard(key)
+            if not child.keys:
+                del node.children[id]
+                return
+            node = child
+        node.key = None
+
+    def stats(self) -> dict[str, int | float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "mean_hit_length": self.reused_tokens / self.hits if self.hits else 0.0,
+                "reused_tokens": self.reused_tokens,
+                "computed_tokens": self.computed_tokens,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
@@ -1,17 +1,39 @@
-from fastapi import APIRouter, Depends
-from pydantic import BaseModel
+import asyncio
+import os
+from typing import AsyncGenerator, AsyncIterator, Callable, Literal, NamedTuple
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, model_validator
 import torch as t
 
 from ..state import AppState, get_state
 from ..data_models import Token, NDIFResponse
 from ..auth import require_user_email
+from ..batching import check_positions, prompt_length
 from ..telemetry import TelemetryClient, RequestStatus
+from ..cache import canonical_key
+from ..encoding import encode_columns, negotiate_encoding
+from ..tokens import TokenTable
 
 
 class LensLineRequest(BaseModel):
     model: str
     prompt: str
-    token: Token
+    token: Token | None = None
+    # Extra positions to decode in the same trace
+    tokens: list[Token] = []
+
+    @model_validator(mode="after")
+    def check_tokens(self):
+        if self.token is None and not self.tokens:
+            raise ValueError("Either token or tokens is required")
+        return self
+
+    @property
+    def all_tokens(self) -> list[Token]:
+        return ([self.token] if self.token is not None else []) + self.tokens
 
 
 class Point(BaseModel):
@@ -30,11 +52,171 @@ class LensLineResponse(NDIFResponse):
 
 router = APIRouter()
 
+# Bytes of float32 logits a lens projection may hold at once
+LENS_MEMORY_BUDGET = int(os.environ.get("LENS_MEMORY_BUDGET", str(256 * 2**20)))
+
+# Vocabulary slice projected per matmul
+LENS_VOCAB_CHUNK = int(os.environ.get("LENS_VOCAB_CHUNK", "32768"))
+
+
+class VocabStats(NamedTuple):
+    """Running softmax statistics of a lens projection, one entry per row."""
+
+    max_N: t.Tensor
+    pred_ids_N: t.Tensor
+    sum_exp_N: t.Tensor
+    # Row and logit of every target, several targets may share a row
+    target_rows_X: t.Tensor | None
+    target_logits_X: t.Tensor | None
+    top_logits_NK: t.Tensor | None
+    top_ids_NK: t.Tensor | None
+
+    def probs(self, logits: t.Tensor) -> t.Tensor:
+        """Softmax probability of logits taken from the same rows, in float32."""
+        max_N = self.max_N.view(-1, *[1] * (logits.dim() - 1))
+        sum_exp_N = self.sum_exp_N.view(-1, *[1] * (logits.dim() - 1))
+        return (logits.float() - max_N).exp() / sum_exp_N
+
+    def target_probs(self) -> t.Tensor:
+        """Softmax probability of every target, in float32."""
+        rows_X = self.target_rows_X
+        return (self.target_logits_X - self.max_N[rows_X]).exp() / self.sum_exp_N[rows_X]
 
-def line(req: LensLineRequest, state: AppState) -> list[t.Tensor]:
+
+def rows_per_chunk(vocab_size: int) -> int:
+    """Rows whose float32 logits over one vocab chunk fit the memory budget."""
+    return max(1, LENS_MEMORY_BUDGET // (min(vocab_size, LENS_VOCAB_CHUNK) * 4))
+
+
+def vocab_stats(
+    model,
+    hidden_ND: t.Tensor,
+    targets: tuple[t.Tensor, t.Tensor] | None = None,
+    top_k: int = 0,
+):
+    """Stream ln_f + lm_head over vocab chunks, keeping a running max, argmax
+    and sum of exp(logits - max) per row, plus the running top_k logits.
+
+    ``targets`` is a pair of row indices and token ids whose logits to keep.
+    Only an N x LENS_VOCAB_CHUNK slice of logits is alive at any time. With a
+    single chunk this reduces to the plain softmax statistics exactly.
+    """
+    weight_VD = model.lm_head.weight
+    bias_V = model.lm_head.bias
+    vocab_size = weight_VD.shape[0]
+
+    # The matmul calls the weight directly, skipping the module's device hooks
+    device = weight_VD.device
+    normed_ND = model.model.ln_f(hidden_ND).to(device)
+
+    n_rows = hidden_ND.shape[0]
+    max_N = t.full((n_rows,), -t.inf, device=device)
+    pred_ids_N = t.zeros(n_rows, dtype=t.long, device=device)
+    sum_exp_N = t.zeros(n_rows, device=device)
+
+    target_rows_X = target_ids_X = target_logits_X = None
+    if targets is not None:
+        target_rows_X, target_ids_X = (x.to(device) for x in targets)
+        target_logits_X = t.zeros(target_ids_X.shape[0], device=device)
+    top_logits_NK = None
+    top_ids_NK = None
+
+    for start in range(0, vocab_size, LENS_VOCAB_CHUNK):
+        end = min(start + LENS_VOCAB_CHUNK, vocab_size)
+        logits_NC = t.nn.functional.linear(
+            normed_ND,
+            weight_VD[start:end],
+            None if bias_V is None else bias_V[start:end],
+        )
+
+        chunk_ids_N = logits_NC.argmax(dim=-1)
+        chunk_max_N = logits_NC.gather(-1, chunk_ids_N.unsqueeze(-1)).squeeze(-1).float()
+
+        # Strictly greater keeps the first maximal id, like a full argmax
+        new_max_N = t.maximum(max_N, chunk_max_N)
+        pred_ids_N = t.where(chunk_max_N > max_N, chunk_ids_N + start, pred_ids_N)
+        sum_exp_N = sum_exp_N * (max_N - new_max_N).exp() + (
+            logits_NC.float() - new_max_N.unsqueeze(-1)
+        ).exp().sum(dim=-1)
+        max_N = new_max_N
+
+        if targets is not None:
+            in_chunk_X = (target_ids_X >= start) & (target_ids_X < end)
+            local_ids_X = (target_ids_X - start).clamp(0, end - start - 1)
+            chunk_targets_X = logits_NC[target_rows_X, local_ids_X].float()
+            target_logits_X = t.where(in_chunk_X, chunk_targets_X, target_logits_X)
+
+        if top_k > 0:
+            chunk_top = logits_NC.topk(min(top_k, end - start), dim=-1)
+            chunk_ids_NK = chunk_top.indices + start
+
+            if top_logits_NK is None:
+                top_logits_NK, top_ids_NK = chunk_top.values, chunk_ids_NK
+            else:
+                # Merge the running top-k with this chunk's
+                merged_logits = t.cat([top_logits_NK, chunk_top.values], dim=-1)
+                merged_ids = t.cat([top_ids_NK, chunk_ids_NK], dim=-1)
+                top_logits_NK, order = merged_logits.topk(
+                    min(top_k, merged_logits.shape[-1]), dim=-1
+                )
+                top_ids_NK = merged_ids.gather(-1, order)
+
+    return VocabStats(
+        max_N,
+        pred_ids_N,
+        sum_exp_N,
+        target_rows_X,
+        target_logits_X,
+        top_logits_NK,
+        top_ids_NK,
+    )
+
+
+def target_probs(
+    model,
+    hidden_ND: t.Tensor,
+    rows_X: t.Tensor,
+    target_ids_X: t.Tensor,
+    chunk_size: int,
+) -> t.Tensor:
+    """Probability of each target id at its row of hidden states.
+
+    Every row is projected once, ``chunk_size`` rows at a time, however many
+    targets it has.
+    """
+    rows_X = rows_X.to(model.lm_head.weight.device)
+    target_ids_X = target_ids_X.to(model.lm_head.weight.device)
+    probs_X = t.zeros(rows_X.shape[0], device=rows_X.device)
+
+    for start in range(0, hidden_ND.shape[0], chunk_size):
+        in_chunk_X = (rows_X >= start) & (rows_X < start + chunk_size)
+        stats = vocab_stats(
+            model,
+            hidden_ND[start : start + chunk_size],
+            (rows_X[in_chunk_X] - start, target_ids_X[in_chunk_X]),
+        )
+        probs_X[in_chunk_X] = stats.target_probs()
+
+    return probs_X.to(hidden_ND.dtype)
+
+
+def line(
+    req: LensLineRequest,
+    state: AppState,
+    on_layer: Callable[[int, t.Tensor], None] | None = None,
+) -> list[t.Tensor]:
+    """Target probabilities per layer, one entry per (position, target) line.
+
+    ``on_layer(layer_idx, probs)`` is called as soon as each layer is decoded.
+    """
     model = state[req.model]
-    idx = req.token.idx
-    target_ids = req.token.target_ids
+    tokens = req.all_tokens
+
+    # Each requested position is projected once, its targets gathered from it
+    idxs = list(dict.fromkeys(token.idx for token in tokens))
+    rows = [idxs.index(token.idx) for token in tokens for _ in token.target_ids]
+    target_ids = [id for token in tokens for id in token.target_ids]
+    chunk_size = rows_per_chunk(model.lm_head.out_features)
 
     with model.trace(
         req.prompt,
@@ -42,26 +224,27 @@ def line(req: LensLineRequest, state: AppState) -> list[t.Tensor]:
         backend=state.make_backend(model=model),
     ) as tracer:
         results = []
-        for layer in model.model.layers:
+        for layer_idx, layer in enumerate(model.model.layers):
             # Decode hidden state into vocabulary
             hidden_BLD = layer.output
 
             if isinstance(hidden_BLD, tuple):
                 hidden_BLD = hidden_BLD[0]
 
-            # NOTE(cadentj): Can't pickle local decode function atm
-            logits_BLV = model.lm_head(model.model.ln_f(hidden_BLD))
-
-            # Compute probabilities over the relevant tokens
-            logits_V = logits_BLV[0, idx, :]
-
-            probs_V = t.nn.functional.softmax(logits_V, dim=-1)
-
-            # Gather probabilities over the predicted tokens
-            target_ids_tensor = t.tensor(target_ids).to(probs_V.device)
-            target_probs_X = t.gather(probs_V, 0, target_ids_tensor)
+            # Only decode the requested positions
+            hidden_PD = hidden_BLD[0, idxs, :]
+            results.append(
+                target_probs(
+                    model,
+                    hidden_PD,
+                    t.tensor(rows),
+                    t.tensor(target_ids),
+                    chunk_size,
+                )
+            )
 
-            results.append(target_probs_X)
+            if on_layer is not None:
+                on_layer(layer_idx, results[-1].cpu())
 
         results.save()
 
@@ -71,43 +254,122 @@ def line(req: LensLineRequest, state: AppState) -> list[t.Tensor]:
     return results
 
 
+def line_batch(reqs: list[LensLineRequest], state: AppState) -> list[list[t.Tensor]]:
+    """``line`` for several prompts at once, as one right-padded trace.
+
+    Every (prompt, position, target) line becomes a row of the same gather,
+    so the vocab projection is shared across requests too. Local only.
+    """
+    if len(reqs) == 1:
+        return [line(reqs[0], state)]
+
+    model = state[reqs[0].model]
+
+    # Each (prompt, position) is projected once, its lines gathered from it
+    positions: dict[tuple[int, int], int] = {}
+    rows, target_ids, counts = [], [], []
+    for batch_idx, req in enumerate(reqs):
+        for token in req.all_tokens:
+            row = positions.setdefault((batch_idx, token.idx), len(positions))
+            rows += [row] * len(token.target_ids)
+            target_ids += token.target_ids
+        counts.append(sum(len(token.target_ids) for token in req.all_tokens))
+
+    batch_idxs = [batch_idx for batch_idx, _ in positions]
+    idxs = [idx for _, idx in positions]
+
+    # Right padding keeps every prompt's positions where they'd be alone
+    inputs = model.tokenizer(
+        [req.prompt for req in reqs],
+        padding=True,
+        padding_side="right",
+        return_tensors="pt",
+    )
+    chunk_size = rows_per_chunk(model.lm_head.out_features)
+
+    with model.trace({**inputs}):
+        results = []
+        for layer in model.model.layers:
+            hidden_BLD = layer.output
+
+            if isinstance(hidden_BLD, tuple):
+                hidden_BLD = hidden_BLD[0]
+
+            batch_idxs_P = t.tensor(batch_idxs).to(hidden_BLD.device)
+            idxs_P = t.tensor(idxs).to(hidden_BLD.device)
+            hidden_PD = hidden_BLD[batch_idxs_P, idxs_P]
+
+            results.append(
+                target_probs(
+                    model,
+                    hidden_PD,
+                    t.tensor(rows),
+                    t.tensor(target_ids),
+                    chunk_size,
+                )
+            )
+
+        results.save()
+
+    # Each request's lines, per layer
+    per_layer = [probs_X.split(counts) for probs_X in results]
+    return [list(layers) for layers in zip(*per_layer)]
+
+
 def get_remote_line(job_id: str, state: AppState):
     backend = state.make_backend(job_id=job_id)
     results = backend()
     return results["results"]
 
 
+def get_line_ids(req: LensLineRequest, state: AppState) -> list[str]:
+    token_table = state.get_tokens(req.model)
+    tokens = req.all_tokens
+
+    line_ids = []
+    for token in tokens:
+        for target_str in token_table.decode(token.target_ids):
+            line_id = target_str.replace(" ", "_")
+
+            # Tell apart the same target at different positions
+            if len(tokens) > 1:
+                line_id = f"{line_id}-{token.idx}"
+
+            line_ids.append(line_id)
+
+    return line_ids
+
+
 def process_line_results(
     results: list[t.Tensor],
     req: LensLineRequest,
     state: AppState,
 ):
-    tok = state[req.model].tokenizer
-    target_token_strs = tok.batch_decode(req.token.target_ids)
-
-    lines = []
+    lines = [Line(id=line_id, data=[]) for line_id in get_line_ids(req, state)]
 
     # Get results into a format for the FE component
     for layer_idx, probs in enumerate(results):
         for line_idx, prob in enumerate(probs.tolist()):
-            if layer_idx == 0:
-                lines.append(
-                    Line(
-                        id=target_token_strs[line_idx].replace(" ", "_"),
-                        data=[Point(x=layer_idx, y=prob)],
-                    )
-                )
-            else:
-                lines[line_idx].data.append(Point(x=layer_idx, y=prob))
+            lines[line_idx].data.append(Point(x=layer_idx, y=prob))
 
     return lines
 
 
+def line_columns(results: list[t.Tensor], req: LensLineRequest, state: AppState):
+    """Columnar line lens: probs is layers x lines, in lineIds order."""
+    return {
+        "lineIds": get_line_ids(req, state),
+        "layers": list(range(len(results))),
+        "probs": t.stack([probs.cpu() for probs in results]),
+    }
+
+
 @router.post("/start-line", response_model=LensLineResponse)
 async def start_line(
     req: LensLineRequest, 
     state: AppState = Depends(get_state),
-    user_email: str = Depends(require_user_email)
+    user_email: str = Depends(require_user_email),
+    encoding: str | None = Depends(negotiate_encoding),
 ):
 
     TelemetryClient.log_request(
@@ -119,7 +381,10 @@ async def start_line(
     )
 
     try:
-        result = line(req, state)
+        if state.remote:
+            result = await state.scheduler.run(req.model, line, req, state)
+        else:
+            result = await cached_line(req, state)
     except Exception as e:
         TelemetryClient.log_request(
             state,
@@ -143,6 +408,9 @@ async def start_line(
         )
         return {"job_id": result}
 
+    if encoding is not None:
+        return encode_columns(line_columns(result, req, state), encoding)
+
     return {"data": process_line_results(result, req, state)}
 
 
@@ -151,11 +419,12 @@ async def collect_line(
     job_id: str,
     req: LensLineRequest,
     state: AppState = Depends(get_state),
-    user_email: str = Depends(require_user_email)
+    user_email: str = Depends(require_user_email),
+    encoding: str | None = Depends(negotiate_encoding),
 ):
 
     try:
-        results = get_remote_line(job_id, state)
+        results = await run_in_threadpool(get_remote_line, job_id, state)
     except Exception as e:
         TelemetryClient.log_request(
             state,
@@ -178,16 +447,65 @@ async def collect_line(
         type="LINE"
     )
 
+    if encoding is not None:
+        return encode_columns(line_columns(results, req, state), encoding)
+
     return {"data": process_line_results(results, req, state)}
 
 
 class GridLensRequest(BaseModel):
     model: str
     prompt: str
+    # Candidates returned per cell
+    top_k: int = Field(default=1, alias="topK", ge=1)
+    # Layers [layerStart, layerEnd) every layerStride, and positions
+    # [positionStart, positionEnd), with Python slice semantics
+    layer_start: int | None = Field(default=None, alias="layerStart")
+    layer_end: int | None = Field(default=None, alias="layerEnd")
+    layer_stride: int = Field(default=1, alias="layerStride", ge=1)
+    position_start: int | None = Field(default=None, alias="positionStart")
+    position_end: int | None = Field(default=None, alias="positionEnd")
+
+    def layer_idxs(self, n_layers: int) -> list[int]:
+        return list(range(n_layers)[self.layer_start : self.layer_end : self.layer_stride])
+
+    @property
+    def positions(self) -> slice:
+        return slice(self.position_start, self.position_end)
+
+    def position_idxs(self, n_tokens: int) -> list[int]:
+        return list(range(n_tokens)[self.positions])
+
+    @property
+    def is_full_window(self) -> bool:
+        return (
+            self.layer_start is None
+            and self.layer_end is None
+            and self.layer_stride == 1
+            and self.position_start is None
+            and self.position_end is None
+        )
+
+
+def check_grid_window(req: GridLensRequest, state: AppState):
+    model = state[req.model]
+
+    if not req.layer_idxs(len(model.model.layers)):
+        raise HTTPException(status_code=400, detail="Layer window is empty")
+
+    if not req.position_idxs(len(model.tokenizer(req.prompt).input_ids)):
+        raise HTTPException(status_code=400, detail="Position window is empty")
+
+
+class Candidate(BaseModel):
+    label: str
+    prob: float
 
 
 class GridCell(Point):
     label: str
+    # Top-k candidates, most likely first, when topK > 1
+    candidates: list[Candidate] | None = None
 
 
 class GridRow(BaseModel):
@@ -200,102 +518,616 @@ class GridLensResponse(NDIFResponse):
     data: list[GridRow] | None = None
 
 
-def heatmap(
-    req: GridLensRequest, state: AppState
-) -> tuple[list[t.Tensor], list[t.Tensor]]:
-    model = state[req.model]
+def project_rows(
+    model, hidden_ND: t.Tensor, chunk_size: int, top_k: int = 0
+) -> tuple[t.Tensor, t.Tensor, t.Tensor | None, t.Tensor | None]:
+    """Top-1 probability and id, plus optional top_k probabilities and ids,
+    for every row of hidden states, ``chunk_size`` rows at a time."""
+    probs, pred_ids, top_probs, top_ids = [], [], [], []
 
-    def _compute_top_probs(
-        logits_BLV,
-        # NOTE(cadentj): Can't put this in the trace body bc of pickling issues
-        probs_list,
-        pred_ids_list,
-    ):
-        relevant_tokens_LV = logits_BLV[0, :, :]
+    for start in range(0, hidden_ND.shape[0], chunk_size):
+        stats = vocab_stats(model, hidden_ND[start : start + chunk_size], top_k=top_k)
+
+        # The top probability is exp(max - logsumexp) = 1 / sum(exp(x - max))
+        probs.append(stats.sum_exp_N.reciprocal().to(hidden_ND.dtype))
+        pred_ids.append(stats.pred_ids_N)
 
-        probs_LV = t.nn.functional.softmax(relevant_tokens_LV, dim=-1)
-        pred_ids_L = relevant_tokens_LV.argmax(dim=-1)
+        if top_k > 0:
+            top_probs.append(stats.probs(stats.top_logits_NK).to(hidden_ND.dtype))
+            top_ids.append(stats.top_ids_NK)
 
-        # Gather probabilities over the predicted tokens
-        pred_ids_L1 = pred_ids_L.unsqueeze(1)
-        probs_L = t.gather(probs_LV, 1, pred_ids_L1).squeeze()
+    if top_k == 0:
+        return t.cat(probs), t.cat(pred_ids), None, None
 
-        pred_ids_list.append(pred_ids_L.tolist())
-        probs_list.append(probs_L.tolist())
+    return t.cat(probs), t.cat(pred_ids), t.cat(top_probs), t.cat(top_ids)
+
+
+class GridResult(NamedTuple):
+    """Grid lens output over the requested window of N layers and L positions."""
+
+    probs_NL: t.Tensor
+    pred_ids_NL: t.Tensor
+    top_probs_NLK: t.Tensor | None = None
+    top_ids_NLK: t.Tensor | None = None
+
+
+def heatmap(
+    req: GridLensRequest,
+    state: AppState,
+    on_layer: Callable[[int, GridResult], None] | None = None,
+) -> GridResult | str | None:
+    """Top-1 (and top-k) lens over the requested window.
+
+    With ``on_layer``, each layer is unembedded as soon as it is reached and
+    handed over as a single layer GridResult instead of being returned.
+    """
+    model = state[req.model]
+    n_layers = len(model.model.layers)
+    layer_idxs = req.layer_idxs(n_layers)
+    top_k = req.top_k if req.top_k > 1 else 0
+    chunk_size = rows_per_chunk(model.lm_head.out_features)
 
     with model.trace(
         req.prompt,
         remote=state.remote,
         backend=state.make_backend(model=model),
     ) as tracer:
-        pred_ids = []
-        probs = []
-
-        for layer in model.model.layers[:-1]:
-            hidden_BLD = layer.output
+        hiddens = []
+        for layer_idx in layer_idxs:
+            hidden_BLD = model.model.layers[layer_idx].output
 
             if isinstance(hidden_BLD, tuple):
                 hidden_BLD = hidden_BLD[0]
 
-            _compute_top_probs(
-                # NOTE(cadentj): Can't put this in the trace body bc of pickling issues
-                model.lm_head(model.model.ln_f(hidden_BLD)),
-                probs,
-                pred_ids,
+            hidden_LD = hidden_BLD[0, req.positions]
+
+            if on_layer is None:
+                # Layers of a sharded model can sit on different devices
+                hiddens.append(hidden_LD.to(model.lm_head.weight.device))
+                continue
+
+            layer_result = project_rows(model, hidden_LD, chunk_size, top_k=top_k)
+            on_layer(
+                layer_idx,
+                GridResult(
+                    *(None if x is None else x.unsqueeze(0).cpu() for x in layer_result)
+                ),
+            )
+
+        if on_layer is None:
+            # Unembed every (layer, position) row in chunks that fit the budget
+            probs_N, pred_ids_N, top_probs_NK, top_ids_NK = project_rows(
+                model, t.cat(hiddens, dim=0), chunk_size, top_k=top_k
             )
-        _compute_top_probs(model.output.logits, probs, pred_ids)
 
-        probs.save()
-        pred_ids.save()
+            results = [
+                probs_N.view(len(layer_idxs), -1).cpu(),
+                pred_ids_N.view(len(layer_idxs), -1).cpu(),
+            ]
+            if top_k > 0:
+                results.append(top_probs_NK.view(len(layer_idxs), -1, top_k).cpu())
+                results.append(top_ids_NK.view(len(layer_idxs), -1, top_k).cpu())
+            results.save()
+
+        # Layers past the window don't need to run
+        if layer_idxs[-1] < n_layers - 1:
+            tracer.stop()
 
     if state.remote:
         return tracer.backend.job_id
 
-    return probs, pred_ids
+    if on_layer is not None:
+        return None
+
+    return GridResult(*results)
 
 
-def get_remote_heatmap(
-    job_id: str, state: AppState
-) -> tuple[list[t.Tensor], list[t.Tensor]]:
+def get_remote_heatmap(job_id: str, state: AppState) -> GridResult:
     backend = state.make_backend(job_id=job_id)
     results = backend()
-    return results["probs"], results["pred_ids"]
+    return GridResult(*results["results"])
 
 
 def process_grid_results(
-    probs: list[t.Tensor],
-    pred_ids: list[t.Tensor],
+    result: GridResult,
     lens_request: GridLensRequest,
     state: AppState,
 ):
     """Background task to process grid lens computation"""
     # Get the stringified tokens of the input
     tok = state[lens_request.model].tokenizer
-    input_strs = tok.batch_decode(tok.encode(lens_request.prompt))
+    token_table = state.get_tokens(lens_request.model)
+    input_ids = tok.encode(lens_request.prompt)
+    input_strs = token_table.decode(input_ids)
+
+    layer_idxs = lens_request.layer_idxs(len(state[lens_request.model].model.layers))
+    seq_idxs = range(len(input_ids))[lens_request.positions]
+    # Position-major so each row below is a contiguous slice
+    probs_LN = result.probs_NL.T.tolist()
+    pred_strs_LN = token_table.decode(result.pred_ids_NL.T)
+
+    if result.top_ids_NLK is not None:
+        top_probs_LNK = result.top_probs_NLK.transpose(0, 1).tolist()
+        top_strs_LNK = token_table.decode(result.top_ids_NLK.transpose(0, 1))
 
     rows = []
-    for seq_idx, input_str in enumerate(input_strs):
+    for row_idx, seq_idx in enumerate(seq_idxs):
         points = [
-            GridCell(
-                x=layer_idx,
-                y=prob[seq_idx],
-                label=tok.decode(pred_id[seq_idx]),
+            GridCell(x=layer_idx, y=prob, label=label)
+            for layer_idx, prob, label in zip(
+                layer_idxs, probs_LN[row_idx], pred_strs_LN[row_idx]
             )
-            for layer_idx, (prob, pred_id) in enumerate(zip(probs, pred_ids))
         ]
+
+        if result.top_ids_NLK is not None:
+            for point, top_probs, top_strs in zip(
+                points, top_probs_LNK[row_idx], top_strs_LNK[row_idx]
+            ):
+                point.candidates = [
+                    Candidate(label=label, prob=prob)
+                    for label, prob in zip(top_strs, top_probs)
+                ]
+
         # Add the input string to the row id to make it unique
-        rows.append(GridRow(id=f"{input_str}-{seq_idx}", data=points))
+        rows.append(GridRow(id=f"{input_strs[seq_idx]}-{seq_idx}", data=points))
 
     return rows
 
 
+# Candidates kept per (layer, position) in the lens cache
+LENS_CACHE_TOP_K = int(os.environ.get("LENS_CACHE_TOP_K", "32"))
+
+# Candidates kept at the final layer. At most 200 tokens can round to a
+# probability of 0.01, so this covers everything a prediction reports.
+LENS_CACHE_FINAL_TOP_K = 256
+
+
+class LensSummary(NamedTuple):
+    """Compact lens output of one prompt: N layers, L positions, K candidates.
+
+    ``top_*_NLK`` cover every layer but the last, whose wider top-k is kept in
+    ``final_*_LK`` to serve predictions.
+    """
+
+    probs_NL: t.Tensor
+    pred_ids_NL: t.Tensor
+    top_probs_NLK: t.Tensor
+    top_ids_NLK: t.Tensor
+    final_probs_LK: t.Tensor
+    final_ids_LK: t.Tensor
+
+    @property
+    def nbytes(self) -> int:
+        return sum(tensor.nbytes for tensor in self)
+
+
+def lens_cache_key(model_name: str, prompt: str, state: AppState) -> str:
+    input_ids = state[model_name].tokenizer.encode(prompt)
+    return canonical_key({"model": model_name, "input_ids": input_ids})
+
+
+def summarize(model_name: str, prompt: str, state: AppState) -> LensSummary:
+    """Run the lens over every layer and position of a prompt in one local trace."""
+    model = state[model_name]
+    n_layers = len(model.model.layers)
+    chunk_size = rows_per_chunk(model.lm_head.out_features)
+
+    with model.trace(prompt):
+        hiddens = []
+        for layer in model.model.layers:
+            hidden_BLD = layer.output
+
+            if isinstance(hidden_BLD, tuple):
+                hidden_BLD = hidden_BLD[0]
+
+            # Layers of a sharded model can sit on different devices
+            hiddens.append(hidden_BLD[0].to(model.lm_head.weight.device))
+
+        probs_N, pred_ids_N, top_probs_NK, top_ids_NK = project_rows(
+            model, t.cat(hiddens[:-1], dim=0), chunk_size, top_k=LENS_CACHE_TOP_K
+        )
+        final_probs_L, final_pred_ids_L, final_probs_LK, final_ids_LK = project_rows(
+            model, hiddens[-1], chunk_size, top_k=LENS_CACHE_FINAL_TOP_K
+        )
+
+        n_rest = n_layers - 1
+        summary = [
+            t.cat([probs_N, final_probs_L]).view(n_layers, -1).cpu(),
+            t.cat([pred_ids_N, final_pred_ids_L]).view(n_layers, -1).int().cpu(),
+            top_probs_NK.view(n_rest, -1, top_probs_NK.shape[-1]).cpu(),
+            top_ids_NK.view(n_rest, -1, top_ids_NK.shape[-1]).int().cpu(),
+            final_probs_LK.cpu(),
+            final_ids_LK.int().cpu(),
+        ].save()
+
+    return LensSummary(*summary)
+
+
+def get_cached_summary(
+    model_name: str, prompt: str, state: AppState
+) -> LensSummary | None:
+    if state.remote:
+        return None
+
+    return state.lens_cache.get(lens_cache_key(model_name, prompt, state))
+
+
+async def get_summary(model_name: str, prompt: str, state: AppState) -> LensSummary:
+    """Cached lens summary of a prompt, computing it on the model if missing."""
+    key = lens_cache_key(model_name, prompt, state)
+    summary = state.lens_cache.get(key)
+
+    if summary is None:
+        summary = await state.scheduler.run(model_name, summarize, model_name, prompt, state)
+        state.lens_cache.put(key, summary)
+
+    return summary
+
+
+def line_from_summary(
+    summary: LensSummary, req: LensLineRequest
+) -> tuple[t.Tensor, list[tuple[int, int, int]]]:
+    """Look up line probabilities in a summary.
+
+    Returns a layers x lines tensor and the (line, position, target id) of
+    every line with a target outside some layer's cached top-k. Those
+    columns are left at zero.
+    """
+    n_layers = summary.probs_NL.shape[0]
+    pairs = [
+        (token.idx, target_id)
+        for token in req.all_tokens
+        for target_id in token.target_ids
+    ]
+
+    results_NX = t.zeros(n_layers, len(pairs), dtype=summary.probs_NL.dtype)
+    missing = []
+
+    for line_idx, (idx, target_id) in enumerate(pairs):
+        hits_NK = summary.top_ids_NLK[:, idx] == target_id
+        final_hits_K = summary.final_ids_LK[idx] == target_id
+
+        if not (hits_NK.any(dim=-1).all() and final_hits_K.any()):
+            missing.append((line_idx, idx, target_id))
+            continue
+
+        # Exactly one candidate matches, so the masked sum is exact
+        results_NX[:-1, line_idx] = (summary.top_probs_NLK[:, idx] * hits_NK).sum(dim=-1)
+        results_NX[-1, line_idx] = (summary.final_probs_LK[idx] * final_hits_K).sum()
+
+    return results_NX, missing
+
+
+def missing_lines(
+    req: LensLineRequest, missing: list[tuple[int, int, int]]
+) -> LensLineRequest:
+    """A line request for just the lines a summary couldn't serve."""
+    return LensLineRequest(
+        model=req.model,
+        prompt=req.prompt,
+        tokens=[
+            Token(idx=idx, id=target_id, text="", targetIds=[target_id])
+            for _, idx, target_id in missing
+        ],
+    )
+
+
+async def cached_line(req: LensLineRequest, state: AppState) -> list[t.Tensor]:
+    """Serve a line lens from the prompt's summary when it is cached.
+
+    Only lines whose targets fall outside the cached top-k go to the model.
+    """
+    length = prompt_length(state, req.model, req.prompt)
+    check_positions((token.idx for token in req.all_tokens), length)
+
+    summary = get_cached_summary(req.model, req.prompt, state)
+    if summary is None:
+        return await state.batcher.run(req.model, line_batch, req, state, length)
+
+    results_NX, missing = line_from_summary(summary, req)
+
+    if missing:
+        fallback = await state.batcher.run(
+            req.model, line_batch, missing_lines(req, missing), state, length
+        )
+
+        line_idxs = [line_idx for line_idx, _, _ in missing]
+        results_NX[:, line_idxs] = t.stack(fallback).cpu().to(results_NX.dtype)
+
+    return list(results_NX)
+
+
+def grid_from_summary(summary: LensSummary, req: GridLensRequest) -> GridResult | None:
+    """Slice the requested window out of a summary, if it kept enough candidates."""
+    if req.top_k > summary.top_ids_NLK.shape[-1]:
+        return None
+
+    layer_idxs = req.layer_idxs(summary.probs_NL.shape[0])
+    result = GridResult(
+        summary.probs_NL[layer_idxs, req.positions],
+        summary.pred_ids_NL[layer_idxs, req.positions],
+    )
+
+    if req.top_k == 1:
+        return result
+
+    k = req.top_k
+    top_probs_NLK = t.cat([summary.top_probs_NLK[..., :k], summary.final_probs_LK[None, :, :k]])
+    top_ids_NLK = t.cat([summary.top_ids_NLK[..., :k], summary.final_ids_LK[None, :, :k]])
+
+    return result._replace(
+        top_probs_NLK=top_probs_NLK[layer_idxs, req.positions],
+        top_ids_NLK=top_ids_NLK[layer_idxs, req.positions],
+    )
+
+
+async def cached_heatmap(req: GridLensRequest, state: AppState) -> GridResult:
+    """Serve a grid lens from the prompt's summary when possible.
+
+    Full grids build the summary. Windowed grids only reuse one that is
+    already cached, so a viewport of a long prompt never pays for the whole grid.
+    """
+    if req.is_full_window and req.top_k <= LENS_CACHE_TOP_K:
+        summary = await get_summary(req.model, req.prompt, state)
+    else:
+        summary = get_cached_summary(req.model, req.prompt, state)
+
+    result = None if summary is None else grid_from_summary(summary, req)
+    if result is None:
+        result = await state.scheduler.run(req.model, heatmap, req, state)
+
+    return result
+
+
+class LineStreamHeader(BaseModel):
+    type: Literal["header"] = "header"
+    ids: list[str]
+
+
+class LineStreamLayer(BaseModel):
+    type: Literal["layer"] = "layer"
+    layer: int
+    # One probability per line, in header order
+    probs: list[float]
+
+
+async def line_layers(
+    req: LensLineRequest, state: AppState
+) -> AsyncIterator[tuple[int, t.Tensor]]:
+    """(layer idx, probs) per layer, from the cache when possible.
+
+    Lines the cached summary can't serve are streamed from the model and
+    filled into each layer as it arrives.
+    """
+    summary = get_cached_summary(req.model, req.prompt, state)
+    if summary is None:
+        async for layer_idx, probs in state.scheduler.stream(req.model, line, req, state):
+            yield layer_idx, probs
+        return
+
+    results_NX, missing = line_from_summary(summary, req)
+    if not missing:
+        for layer_idx, probs in enumerate(results_NX):
+            yield layer_idx, probs
+        return
+
+    line_idxs = [line_idx for line_idx, _, _ in missing]
+    async for layer_idx, probs in state.scheduler.stream(
+        req.model, line, missing_lines(req, missing), state
+    ):
+        results_NX[layer_idx, line_idxs] = probs.to(results_NX.dtype)
+        yield layer_idx, results_NX[layer_idx]
+
+
+async def log_stream(
+    frames: AsyncGenerator[str, None], state: AppState, user_email: str, type: str
+) -> AsyncIterator[str]:
+    """Pass frames through, logging how the stream ended."""
+    try:
+        async for frame in frames:
+            yield frame
+    except (asyncio.CancelledError, GeneratorExit):
+        # Starlette tears down the response when the client disconnects
+        TelemetryClient.log_request(
+            state, RequestStatus.CANCELLED, user_email, method="LENS", type=type
+        )
+        raise
+    except Exception as e:
+        TelemetryClient.log_request(
+            state, RequestStatus.ERROR, user_email, method="LENS", type=type, msg=str(e)
+        )
+        raise
+    finally:
+        # Stops the model job right away rather than whenever it is collected
+        await frames.aclose()
+
+    TelemetryClient.log_request(
+        state, RequestStatus.COMPLETE, user_email, method="LENS", type=type
+    )
+
+
+@router.post("/stream-line")
+async def stream_line(
+    req: LensLineRequest,
+    state: AppState = Depends(get_state),
+    user_email: str = Depends(require_user_email),
+):
+    """Stream the line lens as NDJSON: a header frame, then one frame per layer."""
+    if state.remote:
+        raise HTTPException(status_code=501, detail="Streaming lens is only available locally")
+
+    # Checked before the 200 goes out, a failure mid-stream only truncates it
+    length = prompt_length(state, req.model, req.prompt)
+    check_positions((token.idx for token in req.all_tokens), length)
+
+    TelemetryClient.log_request(
+        state, RequestStatus.STARTED, user_email, method="LENS", type="LINE_STREAM"
+    )
+
+    async def frames():
+        yield LineStreamHeader(ids=get_line_ids(req, state)).model_dump_json() + "\n"
+
+        async for layer_idx, probs in line_layers(req, state):
+            yield LineStreamLayer(layer=layer_idx, probs=probs.tolist()).model_dump_json() + "\n"
+
+    return StreamingResponse(
+        log_stream(frames(), state, user_email, "LINE_STREAM"),
+        media_type="application/x-ndjson",
+    )
+
+
+class GridStreamHeader(BaseModel):
+    type: Literal["header"] = "header"
+    rowIds: list[str]
+    layers: list[int]
+
+
+class GridStreamLayer(BaseModel):
+    type: Literal["layer"] = "layer"
+    layer: int
+    # One cell per row, in header order
+    cells: list[GridCell]
+
+
+def grid_column(
+    result: GridResult, layer_idx: int, row: int, token_table: TokenTable
+) -> list[GridCell]:
+    """Cells of one layer of a grid result, one per position."""
+    cells = [
+        GridCell(x=layer_idx, y=prob, label=label)
+        for prob, label in zip(
+            result.probs_NL[row].tolist(), token_table.decode(result.pred_ids_NL[row])
+        )
+    ]
+
+    if result.top_ids_NLK is not None:
+        top_strs_LK = token_table.decode(result.top_ids_NLK[row])
+        for cell, top_probs, top_strs in zip(
+            cells, result.top_probs_NLK[row].tolist(), top_strs_LK
+        ):
+            cell.candidates = [
+                Candidate(label=label, prob=prob) for label, prob in zip(top_strs, top_probs)
+            ]
+
+    return cells
+
+
+async def grid_layers(
+    req: GridLensRequest, state: AppState
+) -> AsyncIterator[tuple[int, GridResult, int]]:
+    """(layer idx, result, row in result) per layer, from the cache when possible."""
+    summary = get_cached_summary(req.model, req.prompt, state)
+    result = None if summary is None else grid_from_summary(summary, req)
+
+    if result is not None:
+        layer_idxs = req.layer_idxs(summary.probs_NL.shape[0])
+        for row, layer_idx in enumerate(layer_idxs):
+            yield layer_idx, result, row
+        return
+
+    async for layer_idx, layer_result in state.scheduler.stream(
+        req.model, heatmap, req, state
+    ):
+        yield layer_idx, layer_result, 0
+
+
+@router.post("/stream-grid")
+async def stream_grid(
+    req: GridLensRequest,
+    state: AppState = Depends(get_state),
+    user_email: str = Depends(require_user_email),
+):
+    """Stream the grid lens as NDJSON: a header frame, then one column of
+    cells per layer as soon as that layer is unembedded."""
+    if state.remote:
+        raise HTTPException(status_code=501, detail="Streaming lens is only available locally")
+
+    check_grid_window(req, state)
+    n_layers = len(state[req.model].model.layers)
+
+    TelemetryClient.log_request(
+        state, RequestStatus.STARTED, user_email, method="LENS", type="GRID_STREAM"
+    )
+
+    token_table = state.get_tokens(req.model)
+    input_ids = state[req.model].tokenizer.encode(req.prompt)
+    input_strs = token_table.decode(input_ids)
+    seq_idxs = range(len(input_ids))[req.positions]
+
+    async def frames():
+        header = GridStreamHeader(
+            rowIds=[f"{input_strs[seq_idx]}-{seq_idx}" for seq_idx in seq_idxs],
+            layers=req.layer_idxs(n_layers),
+        )
+        yield header.model_dump_json() + "\n"
+
+        async for layer_idx, result, row in grid_layers(req, state):
+            cells = grid_column(result, layer_idx, row, token_table)
+            yield GridStreamLayer(layer=layer_idx, cells=cells).model_dump_json() + "\n"
+
+    return StreamingResponse(
+        log_stream(frames(), state, user_email, "GRID_STREAM"),
+        media_type="application/x-ndjson",
+    )
+
+
+@router.get("/cache-stats")
+async def cache_stats(state: AppState = Depends(get_state)):
+    return state.lens_cache.stats()
+
+
+def grid_columns(result: GridResult, lens_request: GridLensRequest, state: AppState):
+    """Columnar grid lens.
+
+    probs and labelIdxs are layers x positions. Labels are deduplicated into
+    one table that labelIdxs and candidateLabelIdxs index into.
+    """
+    tok = state[lens_request.model].tokenizer
+    token_table = state.get_tokens(lens_request.model)
+    input_ids = tok.encode(lens_request.prompt)
+    input_strs = token_table.decode(input_ids)
+
+    layer_idxs = lens_request.layer_idxs(len(state[lens_request.model].model.layers))
+    seq_idxs = list(range(len(input_ids))[lens_request.positions])
+
+    id_tensors = [result.pred_ids_NL]
+    if result.top_ids_NLK is not None:
+        id_tensors.append(result.top_ids_NLK)
+
+    unique_ids, inverse = t.cat([ids.flatten() for ids in id_tensors]).unique(
+        return_inverse=True
+    )
+    label_idxs = [
+        idxs.view_as(ids).int()
+        for idxs, ids in zip(inverse.split([ids.numel() for ids in id_tensors]), id_tensors)
+    ]
+
+    columns = {
+        "layers": layer_idxs,
+        "positions": seq_idxs,
+        "rowIds": [f"{input_strs[seq_idx]}-{seq_idx}" for seq_idx in seq_idxs],
+        "labels": token_table.decode(unique_ids),
+        "probs": result.probs_NL,
+        "labelIdxs": label_idxs[0],
+    }
+
+    if result.top_ids_NLK is not None:
+        columns["candidateProbs"] = result.top_probs_NLK
+        columns["candidateLabelIdxs"] = label_idxs[1]
+
+    return columns
+
+
 @router.post("/start-grid", response_model=GridLensResponse)
 async def get_grid(
     req: GridLensRequest, 
     state: AppState = Depends(get_state),
-    user_email: str = Depends(require_user_email)   
+    user_email: str = Depends(require_user_email),
+    encoding: str | None = Depends(negotiate_encoding),
 ):
 
+    check_grid_window(req, state)
+
     TelemetryClient.log_request(
         state,
         RequestStatus.STARTED, 
@@ -305,7 +1137,10 @@ async def get_grid(
     )
     
     try:
-        result = heatmap(req, state)
+        if state.remote:
+            result = await state.scheduler.run(req.model, heatmap, req, state)
+        else:
+            result = await cached_heatmap(req, state)
     except Exception as e:
         TelemetryClient.log_request(
             state,
@@ -328,8 +1163,10 @@ async def get_grid(
         )
         return {"job_id": result}
 
-    probs, pred_ids = result
-    return {"data": process_grid_results(probs, pred_ids, req, state)}
+    if encoding is not None:
+        return encode_columns(grid_columns(result, req, state), encoding)
+
+    return {"data": process_grid_results(result, req, state)}
 
 
 @router.post("/results-grid/{job_id}", response_model=GridLensResponse)
@@ -337,10 +1174,11 @@ async def collect_grid(
     job_id: str,
     lens_request: GridLensRequest,
     state: AppState = Depends(get_state),
-    user_email: str = Depends(require_user_email)
+    user_email: str = Depends(require_user_email),
+    encoding: str | None = Depends(negotiate_encoding),
 ):
     try:
-        probs, pred_ids = get_remote_heatmap(job_id, state)
+        result = await run_in_threadpool(get_remote_heatmap, job_id, state)
     except Exception as e:
         TelemetryClient.log_request(
             state,
@@ -361,4 +1199,7 @@ async def collect_grid(
         method="LENS",
         type="GRID"
     )
-    return {"data": process_grid_results(probs, pred_ids, lens_request, state)}
+    if encoding is not None:
+        return encode_columns(grid_columns(result, lens_request, state), encoding)
+
+    return {"data": process_grid_results(result, lens_request, state)}
@@ -1,12 +1,22 @@
+import os
+from typing import Literal
+
 from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
 import torch as t
+from transformers import DynamicCache
 import time
 import requests
 
 from ..state import AppState, get_state
 from ..data_models import Token, NDIFResponse
 from ..auth import require_user_email
+from ..batching import check_positions, prompt_length
+from ..tokens import TokenTable
+from ..prefix_cache import PrefixCache
+from .lens import get_cached_summary
 
 import logging
 
@@ -65,7 +75,7 @@ async def get_models(
 ):
     
     if state.remote:
-        models = get_remot_models(state)
+        models = await run_in_threadpool(get_remot_models, state)
 
         return models
 
@@ -73,10 +83,84 @@ async def get_models(
         return state.get_config().get_model_list()
 
 
+@router.get("/scheduler")
+async def get_scheduler_stats(state: AppState = Depends(get_state)):
+    """Queue depth and wait times for every model's job queue."""
+    return state.scheduler.stats()
+
+
+@router.get("/batching")
+async def get_batching_stats(state: AppState = Depends(get_state)):
+    """Achieved batch sizes of the micro-batched routes, per model."""
+    return state.batcher.stats()
+
+
+def prefix_cache_stats(model_name: str, state: AppState) -> dict | None:
+    prefix_cache = state.get_prefix_cache(model_name)
+    return None if prefix_cache is None else prefix_cache.stats()
+
+
+@router.get("/prefix-cache")
+async def get_prefix_cache_stats(state: AppState = Depends(get_state)):
+    """Prefix hit lengths and memory use of each local model's prompt KV cache."""
+    stats = {}
+    for model_name in state.models:
+        if model_name in state.scheduler.workers:
+            # The cache lives in the model's worker process
+            stats[model_name] = await state.scheduler.run(
+                model_name, prefix_cache_stats, model_name, state
+            )
+        else:
+            stats[model_name] = prefix_cache_stats(model_name, state)
+
+    return stats
+
+
+# Every token whose probability rounds to a nonzero value is in the top
+# 1 / 0.005 = 200, so this default returns the same predictions as the full
+# vocabulary
+PREDICTION_TOP_K = 200
+
+
 class LensCompletion(BaseModel):
     model: str
     prompt: str
     token: Token
+    top_k: int = Field(default=PREDICTION_TOP_K, alias="topK", ge=1)
+    # Only keep the most likely tokens covering this much probability mass
+    top_p: float | None = Field(default=None, alias="topP", gt=0, le=1)
+
+
+def top_p_mask(values_LK: t.Tensor, top_p: float | None) -> t.Tensor:
+    """Zero out descending probabilities once the ones before them cover ``top_p``."""
+    if top_p is None:
+        return values_LK
+
+    before_LK = values_LK.cumsum(dim=-1) - values_LK
+    return values_LK.masked_fill(before_LK >= top_p, 0)
+
+
+def top_tokens(
+    probs_LV: t.Tensor, top_k: int, top_p: float | None = None
+) -> tuple[t.Tensor, t.Tensor]:
+    """Most likely ``top_k`` tokens of each row, reduced on device so only
+    they leave the model host."""
+    values_LK, indices_LK = probs_LV.topk(min(top_k, probs_LV.shape[-1]), dim=-1)
+    return top_p_mask(values_LK, top_p), indices_LK
+
+
+def lookup_prefix(
+    prefix_cache: PrefixCache, model, prompt: str, max_reuse: int | None = None
+) -> tuple[t.Tensor, int, DynamicCache]:
+    """Token ids of a prompt, and the length and KV cache of its longest
+    cached prefix. At least the last token is always left to compute."""
+    input_ids = model.tokenizer(prompt, return_tensors="pt").input_ids
+    limit = input_ids.shape[-1] - 1
+    if max_reuse is not None:
+        limit = min(limit, max_reuse)
+
+    start, past_key_values = prefix_cache.lookup(input_ids[0].tolist(), limit)
+    return input_ids, start, past_key_values
 
 
 def prediction(
@@ -84,34 +168,93 @@ def prediction(
 ) -> tuple[t.Tensor, t.Tensor] | str:
     model = state[req.model]
     idx = req.token.idx
+    top_k, top_p = req.top_k, req.top_p
+    prefix_cache = None if state.remote else state.get_prefix_cache(req.model)
+
+    inputs, start, kwargs = req.prompt, 0, {}
+    if prefix_cache is not None:
+        # Only run the tokens past the longest cached prefix, from idx at the latest
+        input_ids, start, past_key_values = lookup_prefix(
+            prefix_cache, model, req.prompt, max_reuse=idx
+        )
+        inputs = {
+            "input_ids": input_ids[:, start:],
+            "attention_mask": t.ones_like(input_ids),
+        }
+        kwargs = {"past_key_values": past_key_values}
 
     with model.trace(
-        req.prompt,
+        inputs,
         remote=state.remote,
         backend=state.make_backend(model=model),
+        **kwargs,
     ) as tracer:
         logits_BLV = model.lm_head.output
 
         # Get logits for the correct index
-        logits_LV = logits_BLV[0, [idx], :].softmax(dim=-1)
+        probs_LV = logits_BLV[0, [idx - start], :].softmax(dim=-1)
 
-        # Sort logits by descending probability
-        values_LV_indices_LV = t.sort(logits_LV, dim=-1, descending=True)
+        # Most likely tokens by descending probability
+        values_LK, indices_LK = top_tokens(probs_LV, top_k, top_p)
 
-        values_LV = values_LV_indices_LV[0].save()
-        indices_LV = values_LV_indices_LV[1].save()
+        values_LK = values_LK.save()
+        indices_LK = indices_LK.save()
 
     if state.remote: 
         return tracer.backend.job_id
 
-    return values_LV, indices_LV
+    if prefix_cache is not None:
+        # The forward pass extended the cache to the whole prompt
+        prefix_cache.put(input_ids[0].tolist(), past_key_values)
+
+    return values_LK, indices_LK
+
+def prediction_batch(
+    reqs: list[LensCompletion], state: AppState
+) -> list[tuple[t.Tensor, t.Tensor]]:
+    """``prediction`` for several prompts at once, as one right-padded trace.
+
+    Local only. A lone request keeps its prefix cache reuse.
+    """
+    if len(reqs) == 1:
+        return [prediction(reqs[0], state)]
+
+    model = state[reqs[0].model]
+    max_k = max(req.top_k for req in reqs)
+
+    # Right padding keeps every prompt's positions where they'd be alone
+    inputs = model.tokenizer(
+        [req.prompt for req in reqs],
+        padding=True,
+        padding_side="right",
+        return_tensors="pt",
+    )
+    idxs_N = t.tensor([req.token.idx for req in reqs])
+
+    with model.trace({**inputs}):
+        logits_BLV = model.lm_head.output
+        probs_NV = logits_BLV[t.arange(len(reqs)), idxs_N].softmax(dim=-1)
+
+        values_NK, indices_NK = top_tokens(probs_NV, max_k)
+        values_NK = values_NK.save()
+        indices_NK = indices_NK.save()
+
+    # Each request's own top_k and top_p, as a batch of one row
+    return [
+        (
+            top_p_mask(values_NK[[n], : req.top_k], req.top_p),
+            indices_NK[[n], : req.top_k],
+        )
+        for n, req in enumerate(reqs)
+    ]
+
 
 def get_remote_prediction(
     job_id: str, state: AppState
 ) -> tuple[t.Tensor, t.Tensor]:
     backend = state.make_backend(job_id=job_id)
     results = backend()
-    return results["values_LV"], results["indices_LV"]
+    return results["values_LK"], results["indices_LK"]
 
 
 class Prediction(BaseModel):
@@ -125,31 +268,34 @@ class PredictionResponse(NDIFResponse):
     data: Prediction | None = None
 
 
-def process_prediction(
-    values_LV: t.Tensor,
-    indices_LV: t.Tensor,
-    req: LensCompletion,
-    state: AppState,
-):
-    tok = state[req.model].tokenizer
-    idxs = [req.token.idx]
-
+def to_prediction(
+    idx: int, values_K: t.Tensor, indices_K: t.Tensor, token_table: TokenTable
+) -> Prediction:
+    """Tokens of a top-k distribution whose probability rounds to nonzero."""
     # Round values to 2 decimal places
-    idx_values = t.round(values_LV[0] * 100) / 100
+    idx_values = t.round(values_K * 100) / 100
     nonzero = idx_values > 0
 
     nonzero_values = idx_values[nonzero].tolist()
-    nonzero_indices = indices_LV[0][nonzero].tolist()
-    nonzero_texts = tok.batch_decode(nonzero_indices)
+    nonzero_indices = indices_K[nonzero].tolist()
+    nonzero_texts = token_table.decode(nonzero_indices)
 
-    prediction = Prediction(
-        idx=idxs[0],
+    return Prediction(
+        idx=idx,
         ids=nonzero_indices,
         probs=nonzero_values,
         texts=nonzero_texts,
     )
 
-    return prediction
+
+def process_prediction(
+    values_LK: t.Tensor,
+    indices_LK: t.Tensor,
+    req: LensCompletion,
+    state: AppState,
+):
+    token_table = state.get_tokens(req.model)
+    return to_prediction(req.token.idx, values_LK[0], indices_LK[0], token_table)
 
 
 @router.post("/start-prediction", response_model=PredictionResponse)
@@ -158,12 +304,40 @@ async def start_prediction(
     state: AppState = Depends(get_state),
     user_email: str = Depends(require_user_email)
 ):
-    result = prediction(prediction_request, state)
+    length = prompt_length(state, prediction_request.model, prediction_request.prompt)
+    check_positions([prediction_request.token.idx], length)
+
+    # Served from the lens cache when the prompt was already run
+    summary = get_cached_summary(
+        prediction_request.model, prediction_request.prompt, state
+    )
+    top_k = prediction_request.top_k
+    if summary is not None and top_k <= summary.final_probs_LK.shape[-1]:
+        idx = prediction_request.token.idx
+        values_LK = top_p_mask(
+            summary.final_probs_LK[[idx], :top_k], prediction_request.top_p
+        )
+        data = process_prediction(
+            values_LK,
+            summary.final_ids_LK[[idx], :top_k],
+            prediction_request,
+            state,
+        )
+        return {"data": data}
+
     if state.remote:
-        return {"job_id": result}
+        job_id = await state.scheduler.run(
+            prediction_request.model, prediction, prediction_request, state
+        )
+        return {"job_id": job_id}
+
+    # Shares a forward pass with concurrent predictions on the model
+    result = await state.batcher.run(
+        prediction_request.model, prediction_batch, prediction_request, state, length
+    )
 
-    values_LV, indices_LV = result
-    data = process_prediction(values_LV, indices_LV, prediction_request, state)
+    values_LK, indices_LK = result
+    data = process_prediction(values_LK, indices_LK, prediction_request, state)
     return {"data": data}
 
 
@@ -174,16 +348,164 @@ async def results_prediction(
     state: AppState = Depends(get_state),
     user_email: str = Depends(require_user_email)
 ):
-    values_LV, indices_LV = get_remote_prediction(job_id, state)
-    data = process_prediction(values_LV, indices_LV, prediction_request, state)
+    values_LK, indices_LK = await run_in_threadpool(
+        get_remote_prediction, job_id, state
+    )
+    data = process_prediction(values_LK, indices_LK, prediction_request, state)
     return {"data": data}
 
 
+# Padded tokens per forward pass of a batched prediction
+BATCH_PREDICTION_TOKENS = int(os.environ.get("BATCH_PREDICTION_TOKENS", "8192"))
+
+
+class BatchPredictionItem(BaseModel):
+    prompt: str
+    token: Token
+
+
+class BatchPredictionRequest(BaseModel):
+    model: str
+    items: list[BatchPredictionItem] = Field(min_length=1)
+    top_k: int = Field(default=PREDICTION_TOP_K, alias="topK", ge=1)
+    top_p: float | None = Field(default=None, alias="topP", gt=0, le=1)
+
+
+class BatchPredictionResponse(NDIFResponse):
+    # One prediction per item, in request order
+    data: list[Prediction] | None = None
+
+
+def batch_chunks(lengths: list[int], budget: int) -> list[list[int]]:
+    """Group item indices into batches whose padded size fits ``budget``
+    tokens. Items of similar length share a batch to keep padding down."""
+    chunks = [[]]
+    for i in sorted(range(len(lengths)), key=lengths.__getitem__):
+        # Sorted ascending, so this item sets the batch's padded length
+        if chunks[-1] and (len(chunks[-1]) + 1) * lengths[i] > budget:
+            chunks.append([])
+        chunks[-1].append(i)
+
+    return chunks
+
+
+def batch_inputs(
+    req: BatchPredictionRequest, state: AppState
+) -> tuple[list[list[int]], list[tuple[dict, t.Tensor]]]:
+    """Chunks of item indices, and each chunk's right-padded inputs and
+    prediction positions."""
+    tokenizer = state[req.model].tokenizer
+    lengths = [len(tokenizer(item.prompt).input_ids) for item in req.items]
+
+    # Past its own prompt, an idx would read the padding of a longer one
+    for i, (item, length) in enumerate(zip(req.items, lengths)):
+        if not 0 <= item.token.idx < length:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Item {i}: token position {item.token.idx} is outside "
+                f"its {length} token prompt",
+            )
+
+    chunks = batch_chunks(lengths, BATCH_PREDICTION_TOKENS)
+
+    batches = []
+    for chunk in chunks:
+        # Right padding keeps every prompt's positions where they'd be alone
+        inputs = tokenizer(
+            [req.items[i].prompt for i in chunk],
+            padding=True,
+            padding_side="right",
+            return_tensors="pt",
+        )
+        idxs_N = t.tensor([req.items[i].token.idx for i in chunk])
+        batches.append(({**inputs}, idxs_N))
+
+    return chunks, batches
+
+
+def batch_prediction(
+    req: BatchPredictionRequest, state: AppState
+) -> list[list[t.Tensor]] | str:
+    """Top tokens of every item, one padded trace per chunk, all in one session."""
+    model = state[req.model]
+    top_k, top_p = req.top_k, req.top_p
+    _, batches = batch_inputs(req, state)
+
+    with model.session(
+        remote=state.remote,
+        backend=state.make_backend(model=model),
+    ) as session:
+        results = list().save()
+
+        for inputs, idxs_N in batches:
+            with model.trace(inputs):
+                logits_BLV = model.lm_head.output
+                probs_NV = logits_BLV[t.arange(len(idxs_N)), idxs_N].softmax(dim=-1)
+
+                values_NK, indices_NK = top_tokens(probs_NV, top_k, top_p)
+                results.append([values_NK, indices_NK])
+
+    if state.remote:
+        return session.backend.job_id
+
+    return results
+
+
+def get_remote_batch_prediction(job_id: str, state: AppState) -> list[list[t.Tensor]]:
+    backend = state.make_backend(job_id=job_id)
+    results = backend()
+    return results["results"]
+
+
+def process_batch_prediction(
+    results: list[list[t.Tensor]], req: BatchPredictionRequest, state: AppState
+) -> list[Prediction]:
+    token_table = state.get_tokens(req.model)
+    chunks, _ = batch_inputs(req, state)
+
+    predictions = [None] * len(req.items)
+    for chunk, (values_NK, indices_NK) in zip(chunks, results):
+        for n, i in enumerate(chunk):
+            predictions[i] = to_prediction(
+                req.items[i].token.idx, values_NK[n], indices_NK[n], token_table
+            )
+
+    return predictions
+
+
+@router.post("/start-batch-prediction", response_model=BatchPredictionResponse)
+async def start_batch_prediction(
+    req: BatchPredictionRequest,
+    state: AppState = Depends(get_state),
+    user_email: str = Depends(require_user_email)
+):
+    result = await state.scheduler.run(req.model, batch_prediction, req, state)
+    if state.remote:
+        return {"job_id": result}
+
+    return {"data": process_batch_prediction(result, req, state)}
+
+
+@router.post(
+    "/results-batch-prediction/{job_id}", response_model=BatchPredictionResponse
+)
+async def results_batch_prediction(
+    job_id: str,
+    req: BatchPredictionRequest,
+    state: AppState = Depends(get_state),
+    user_email: str = Depends(require_user_email)
+):
+    results = await run_in_threadpool(get_remote_batch_prediction, job_id, state)
+    return {"data": process_batch_prediction(results, req, state)}
+
+
 class Completion(BaseModel):
     prompt: str
     max_new_tokens: int
     model: str
     temperature: float = 1.0
+    top_k: int = Field(default=PREDICTION_TOP_K, alias="topK", ge=1)
+    top_p: float | None = Field(default=None, alias="topP", gt=0, le=1)
 
 
 class Generation(BaseModel):
@@ -197,30 +519,43 @@ class GenerationResponse(NDIFResponse):
 
 def generate(req: Completion, state: AppState):
     model = state[req.model]
+    top_k, top_p = req.top_k, req.top_p
+    prefix_cache = None if state.remote else state.get_prefix_cache(req.model)
+
+    inputs, kwargs = req.prompt, {}
+    if prefix_cache is not None:
+        # generate() skips the positions already in past_key_values
+        input_ids, _, past_key_values = lookup_prefix(prefix_cache, model, req.prompt)
+        inputs = {"input_ids": input_ids, "attention_mask": t.ones_like(input_ids)}
+        kwargs = {"past_key_values": past_key_values}
 
     with model.generate(
-        req.prompt,
+        inputs,
         max_new_tokens=req.max_new_tokens,
         temperature=req.temperature,
         do_sample=True,
         remote=state.remote,
         backend=state.make_backend(model=model),
+        **kwargs,
     ) as generator:
         logits = []
         with model.lm_head.all():
             logits.append(model.lm_head.output)
 
         probs_V = logits[0][0, -1, :].softmax(dim=-1)
-        values_V_indices_V = t.sort(probs_V, dim=-1, descending=True)
-        values_V = values_V_indices_V[0].save()
-        indices_V = values_V_indices_V[1].save()
+        values_K, indices_K = top_tokens(probs_V, top_k, top_p)
+        values_K = values_K.save()
+        indices_K = indices_K.save()
 
         new_token_ids = model.generator.output.save()
 
     if state.remote:
         return generator.backend.job_id
 
-    return values_V, indices_V, new_token_ids[0]
+    if prefix_cache is not None:
+        prefix_cache.put(input_ids[0].tolist(), past_key_values)
+
+    return values_K, indices_K, new_token_ids[0]
 
 
 def get_remote_generate(
@@ -228,12 +563,12 @@ def get_remote_generate(
 ) -> tuple[t.Tensor, t.Tensor, t.Tensor]:
     backend = state.make_backend(job_id=job_id)
     results = backend()
-    return results["values_V"], results["indices_V"], results["new_token_ids"]
+    return results["values_K"], results["indices_K"], results["new_token_ids"]
 
 
 def process_generation_results(
-    values_V: t.Tensor,
-    indices_V: t.Tensor,
+    values_K: t.Tensor,
+    indices_K: t.Tensor,
     new_token_ids: t.Tensor,
     req: Completion,
     state: AppState,
@@ -250,25 +585,15 @@ def process_generation_results(
         # Generator output includes prompt, so slice to get only new tokens
         new_token_ids = new_token_ids[prompt_length:]
     
-    new_token_text = tok.batch_decode(new_token_ids)
+    token_table = state.get_tokens(req.model)
+    new_token_text = token_table.decode(new_token_ids)
     tokens = [
         Token(idx=i, id=id, text=text, targetIds=[])
         for i, (id, text) in enumerate(zip(new_token_ids, new_token_text))
     ]
 
-    # Round values to 2 decimal places
-    idx_values = t.round(values_V * 100) / 100
-    nonzero = idx_values > 0
-
-    nonzero_values = idx_values[nonzero].tolist()
-    nonzero_indices = indices_V[nonzero].tolist()
-    nonzero_texts = tok.batch_decode(nonzero_indices)
-
-    last_token_prediction = Prediction(
-        idx=new_token_ids[-1],
-        ids=nonzero_indices,
-        probs=nonzero_values,
-        texts=nonzero_texts,
+    last_token_prediction = to_prediction(
+        new_token_ids[-1], values_K, indices_K, token_table
     ).model_dump()
 
     return {
@@ -283,14 +608,14 @@ async def start_generate(
     state: AppState = Depends(get_state),
     user_email: str = Depends(require_user_email)
 ):
-    result = generate(req, state)
+    result = await state.scheduler.run(req.model, generate, req, state)
     if state.remote:
         return {"job_id": result}
     
-    values_V, indices_V, new_token_ids = result
+    values_K, indices_K, new_token_ids = result
 
     data = process_generation_results(
-        values_V, indices_V, new_token_ids, req, state
+        values_K, indices_K, new_token_ids, req, state
     )
     return {"data": data}
 
@@ -302,8 +627,101 @@ async def results_generate(
     state: AppState = Depends(get_state),
     user_email: str = Depends(require_user_email)
 ):
-    values_V, indices_V, new_token_ids = get_remote_generate(job_id, state)
+    values_K, indices_K, new_token_ids = await run_in_threadpool(
+        get_remote_generate, job_id, state
+    )
     data = process_generation_results(
-        values_V, indices_V, new_token_ids, req, state
+        values_K, indices_K, new_token_ids, req, state
     )
     return {"data": data}
+
+
+class GenerationStreamRequest(Completion):
+    # Send the top-k distribution each token was sampled from
+    predictions: bool = False
+
+
+class GenerationStreamToken(BaseModel):
+    type: Literal["token"] = "token"
+    token: Token
+    # The temperature-scaled distribution the token was sampled from. It is
+    # taken before the generation config's own top-k/top-p filtering, and
+    # topK/topP only trim what is shown
+    prediction: Prediction | None = None
+
+
+class GenerationStreamEnd(BaseModel):
+    type: Literal["end"] = "end"
+    # "length" after max_new_tokens, "stop" if the model ended the text first
+    reason: Literal["length", "stop"]
+
+
+def generate_tokens(req: GenerationStreamRequest, state: AppState, emit):
+    """Generate locally, calling ``emit(id, values_K, indices_K)`` as soon as
+    each token is sampled. The distribution is None unless requested."""
+    model = state[req.model]
+    prefix_cache = state.get_prefix_cache(req.model)
+
+    inputs, kwargs = req.prompt, {}
+    if prefix_cache is not None:
+        input_ids, _, past_key_values = lookup_prefix(prefix_cache, model, req.prompt)
+        inputs = {"input_ids": input_ids, "attention_mask": t.ones_like(input_ids)}
+        kwargs = {"past_key_values": past_key_values}
+
+    with model.generate(
+        inputs,
+        max_new_tokens=req.max_new_tokens,
+        temperature=req.temperature,
+        do_sample=True,
+        **kwargs,
+    ) as tracer:
+        values_K = indices_K = None
+
+        # The streamer sees the prompt, then each sampled token. The extra
+        # step reads the last token once the final forward pass is done.
+        with tracer.iter[: req.max_new_tokens + 1] as step:
+            ids = model.generator.streamer.output
+
+            if step > 0:
+                emit(ids.reshape(-1)[-1].item(), values_K, indices_K)
+
+            if step < req.max_new_tokens and req.predictions:
+                logits_V = model.lm_head.output[0, -1] / req.temperature
+                probs_V = logits_V.softmax(dim=-1)
+                values_K, indices_K = top_tokens(probs_V, req.top_k, req.top_p)
+
+    if prefix_cache is not None:
+        prefix_cache.put(input_ids[0].tolist(), past_key_values)
+
+
+@router.post("/stream-generate")
+async def stream_generate(
+    req: GenerationStreamRequest,
+    state: AppState = Depends(get_state),
+    user_email: str = Depends(require_user_email)
+):
+    """Stream a generation as NDJSON, one frame per token as it is sampled,
+    then an end frame. Closing the connection stops the generation."""
+    if state.remote:
+        raise HTTPException(status_code=501, detail="Streaming generation is only available locally")
+
+    token_table = state.get_tokens(req.model)
+
+    async def frames():
+        n_tokens = 0
+
+        async for id, values_K, indices_K in state.scheduler.stream(
+            req.model, generate_tokens, req, state
+        ):
+            prediction = None
+            if values_K is not None:
+                prediction = to_prediction(n_tokens, values_K, indices_K, token_table)
+
+            token = Token(idx=n_tokens, id=id, text=token_table[id], targetIds=[])
+            yield GenerationStreamToken(token=token, prediction=prediction).model_dump_json(by_alias=True) + "\n"
+            n_tokens += 1
+
+        reason = "length" if n_tokens == req.max_new_tokens else "stop"
+        yield GenerationStreamEnd(reason=reason).model_dump_json() + "\n"
+
+    return StreamingResponse(frames(), media_type="application/x-ndjson")
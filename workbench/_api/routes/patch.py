@@ -1,17 +1,27 @@
-from itertools import chain
-from typing import List
+from collections import Counter, defaultdict
+from itertools import chain, groupby
+from typing import AsyncIterator, Iterator, List, NamedTuple, Tuple
 import asyncio
 
 import einops
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, Request, Response
+from fastapi.responses import StreamingResponse
 from nnsight import LanguageModel
-import nnsight as ns
 import torch as t
-from transformers import AutoTokenizer
+from transformers import AutoTokenizer, DynamicCache
 
 from pydantic import BaseModel, ConfigDict, Field, model_validator
 from typing import Optional, Literal
 
+from ..auth import require_user_email
+from ..cache import canonical_key
+from ..cancellation import CancellationToken, JobCancelled
+from ..encoding import encode_columns, negotiate_encoding
+from ..prefix_cache import build_cache, cache_tensors
+from ..scheduler import Priority
+from ..tokens import TokenTable
+from ..telemetry import TelemetryClient, RequestStatus
+
 
 """
 Dimension key:
@@ -27,6 +37,12 @@ Dh: size of each attention head
 
 EPS = 1e-10
 
+# Seconds between client disconnect checks while a sweep runs
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# Number of patched copies of the destination prompt run in a single forward pass
+DEFAULT_CHUNK_SIZE = 16
+
 
 class Point(BaseModel):
     model_config = ConfigDict(frozen=True)
@@ -65,6 +81,22 @@ class PatchRequest(BaseModel):
     correct_id: int = Field(alias="correctId")
     incorrect_id: Optional[int] = Field(default=None, alias="incorrectId")
 
+    # Max batch rows per patched forward pass. Trades memory for fewer passes.
+    chunk_size: int = Field(default=DEFAULT_CHUNK_SIZE, alias="chunkSize", gt=0)
+
+    # "exact" runs a patched forward pass per cell. "attribution" estimates every
+    # cell with a first-order approximation from three passes total.
+    method: Literal["exact", "attribution"] = "exact"
+
+    # Start each exact patched run at its first patched layer from cached
+    # destination residuals instead of re-running the earlier layers.
+    resume_layers: bool = Field(default=True, alias="resumeLayers")
+
+    # Token sweeps only: compute the destination KV cache once and run each
+    # patched position over the suffix that follows it. Falls back to full
+    # recompute for models without a DynamicCache.
+    reuse_prefix: bool = Field(default=False, alias="reusePrefix")
+
     @model_validator(mode="after")
     def validate_request(self):
         if self.submodule == "heads" and self.patch_tokens:
@@ -79,6 +111,26 @@ class PatchResponse(BaseModel):
     colLabels: List[str | int] = Field(default_factory=list)
 
 
+class PatchHeader(BaseModel):
+    """First frame of a streamed patch grid."""
+
+    type: Literal["header"] = "header"
+    rowLabels: List[str | int] = Field(default_factory=list)
+    colLabels: List[str | int] = Field(default_factory=list)
+
+
+class PatchRow(BaseModel):
+    """One finished layer row of a streamed patch grid."""
+
+    type: Literal["row"] = "row"
+    row: int
+    label: str | int
+    results: List[float]
+
+
+PatchEvent = PatchHeader | PatchRow
+
+
 def get_components(model, patching_request: PatchRequest):
     layers = model.model.layers
     match patching_request.submodule:
@@ -112,213 +164,635 @@ def get_prob(model, patching_request: PatchRequest):
     return probs[0, -1, patching_request.correct_id]
 
 
-def patch_components(model: LanguageModel, patching_request: PatchRequest):
-    components = get_components(model, patching_request)
-    is_tuple = patching_request.submodule == "blocks"
-
-    source_cache = {}
-
-    with model.wrapped_session():
-        results = ns.list().save()
-
-        with model.trace(patching_request.source):
-            for component in components:
-                hidden_BLD = component.output
-
-                if is_tuple:
-                    hidden_BLD = hidden_BLD[0]
-
-                source_cache[component] = hidden_BLD
-
-            if patching_request.incorrect_id is not None:
-                source_diff = logit_difference(model, patching_request)
-
-        with model.trace(patching_request.destination):
-            destination_diff = logit_difference(model, patching_request)
-
-        for component in components:
-            with model.trace(
-                patching_request.destination,
-            ):
-                if is_tuple:
-                    hidden_BLD_tuple = component.output
-                    component.output = (
-                        source_cache[component],
-                        hidden_BLD_tuple[1],
-                    )
-                else:
-                    component.output = source_cache[component]
-
-                if patching_request.incorrect_id is not None:
-                    patched_diff = logit_difference(model, patching_request)
-                    ioi_metric = compute_ioi_metric(
-                        source_diff, destination_diff, patched_diff
-                    )
-                    results.append(ioi_metric)
-                else:
-                    prob = get_prob(model, patching_request)
-                    results.append(prob)
+class PatchBaseline(NamedTuple):
+    source_cache: list
+    source_diff: Optional[t.Tensor]
+    destination_diff: Optional[t.Tensor]
+    # Output of every layer on the clean destination run
+    destination_cache: Optional[list]
+    # Per-layer (key, value) tensors of the clean destination run
+    prefix_cache: Optional[tuple]
+
+
+def get_baseline(
+    model: LanguageModel, patching_request: PatchRequest, cache_source
+) -> PatchBaseline:
+    """Run the clean source and destination prompts once.
+
+    ``cache_source()`` is called inside the source trace and returns
+    whichever source activations the sweep needs.
+    """
+    has_diff = patching_request.incorrect_id is not None
+    resume = patching_request.resume_layers
+    reuse_prefix = patching_request.reuse_prefix and patching_request.patch_tokens
+
+    with model.trace(patching_request.source):
+        source_cache = cache_source().save()
+
+        if has_diff:
+            source_diff = logit_difference(model, patching_request).save()
+
+    if not (has_diff or resume or reuse_prefix):
+        return PatchBaseline(source_cache, None, None, None, None)
+
+    # Only ask for the KV cache when reusing it, so layer outputs cached for
+    # resume_from come from the same settings as the patched runs
+    kwargs = {"use_cache": True} if reuse_prefix else {}
+
+    with model.trace(patching_request.destination, **kwargs):
+        if resume:
+            destination_cache = [layer.output for layer in model.model.layers].save()
+
+        if has_diff:
+            destination_diff = logit_difference(model, patching_request).save()
+
+        if reuse_prefix:
+            past_key_values = model.output.past_key_values.save()
+
+    # Without a readable KV cache the sweep runs whole prompts instead
+    prefix_cache = None
+    if reuse_prefix and isinstance(past_key_values, DynamicCache):
+        layers = cache_tensors(past_key_values)
+        if layers is not None:
+            prefix_cache = tuple(
+                (key.detach(), value.detach()) for key, value in layers
+            )
+
+    return PatchBaseline(
+        source_cache,
+        source_diff if has_diff else None,
+        destination_diff if has_diff else None,
+        destination_cache if resume else None,
+        prefix_cache,
+    )
+
+
+def expand_output(output, n_rows: int, start: int = 0):
+    """Repeat a batch-size-1 module output along the batch dimension.
+
+    Positions before ``start`` are dropped.
+    """
+    if isinstance(output, tuple):
+        return (expand_output(output[0], n_rows, start),) + output[1:]
+
+    output = output[:, start:]
+    return output.expand(n_rows, *output.shape[1:]).contiguous()
+
+
+def resume_from(
+    model, baseline: PatchBaseline, layer_idx: int, n_rows: int, start: int = 0
+):
+    """Skip every layer before ``layer_idx``, reusing the cached destination outputs.
+
+    Layers before the first patched layer produce the same activations as the
+    clean destination run, so there is no need to recompute them.
+    """
+    if baseline.destination_cache is None:
+        return
+
+    for layer, output in zip(
+        model.model.layers[:layer_idx], baseline.destination_cache[:layer_idx]
+    ):
+        layer.skip(expand_output(output, n_rows, start))
+
+
+def get_prefix_inputs(
+    destination_ids: t.Tensor, prefix_cache: tuple, start: int, n_rows: int
+):
+    """Build suffix inputs and a KV cache of the first ``start`` destination tokens."""
+    n_tokens = destination_ids.shape[-1]
+
+    inputs = {
+        "input_ids": destination_ids[start:].expand(n_rows, -1),
+        "attention_mask": t.ones(n_rows, n_tokens, dtype=t.long),
+    }
+
+    past_key_values = build_cache(
+        tuple(
+            (
+                key[:, :, :start].expand(n_rows, -1, -1, -1),
+                value[:, :, :start].expand(n_rows, -1, -1, -1),
+            )
+            for key, value in prefix_cache
+        )
+    )
+
+    return inputs, past_key_values
+
+
+def batched_metric(model, patching_request: PatchRequest, baseline: PatchBaseline):
+    """Compute the patching metric for every row of a batched destination run."""
+    logits_BV = model.lm_head.output[:, -1, :]
+
+    if patching_request.incorrect_id is not None:
+        patched_diff_B = (
+            logits_BV[:, patching_request.correct_id]
+            - logits_BV[:, patching_request.incorrect_id]
+        )
+        return compute_ioi_metric(
+            baseline.source_diff, baseline.destination_diff, patched_diff_B
+        )
+
+    probs_BV = t.softmax(logits_BV, dim=-1)
+    return probs_BV[:, patching_request.correct_id]
+
+
+def get_hidden(output):
+    """Get the hidden state from a module output which may be a tuple."""
+    if isinstance(output, tuple):
+        return output[0]
+
+    return output
+
+
+def chunked(items: list, chunk_size: int):
+    for start in range(0, len(items), chunk_size):
+        yield items[start : start + chunk_size]
+
+
+def assemble_rows(
+    values: Iterator[Tuple[int, float]],
+    cell_layers: List[int],
+    make_row,
+    cancel: Optional[CancellationToken] = None,
+) -> Iterator[PatchRow]:
+    """Group streamed (cell index, value) pairs into rows as each layer finishes.
+
+    ``make_row(layer_idx, row_values)`` receives the layer's values keyed by
+    cell index, in cell order. ``cancel`` is checked before pulling each value,
+    so a cancelled sweep stops before its next forward pass.
+    """
+    remaining = Counter(cell_layers)
+    row_values = defaultdict(dict)
+
+    while True:
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+
+        try:
+            cell_idx, value = next(values)
+        except StopIteration:
+            return
+
+        layer_idx = cell_layers[cell_idx]
+        row_values[layer_idx][cell_idx] = value
+        remaining[layer_idx] -= 1
+
+        if remaining[layer_idx] == 0:
+            values_by_cell = row_values.pop(layer_idx)
+            yield make_row(
+                layer_idx, {idx: values_by_cell[idx] for idx in sorted(values_by_cell)}
+            )
+
+
+def layer_row(layer_idx: int, row_values: dict[int, float]) -> PatchRow:
+    """A row labelled with its layer, holding its values in cell order."""
+    return PatchRow(row=layer_idx, label=layer_idx, results=list(row_values.values()))
+
+
+def collect_patch_response(events: Iterator[PatchEvent]) -> PatchResponse:
+    """Drain a patch event stream into a single PatchResponse."""
+    header = next(events)
+    rows = sorted(events, key=lambda row: row.row)
 
     return PatchResponse(
-        results=[[r] for r in results],
+        results=[row.results for row in rows],
+        rowLabels=header.rowLabels,
+        colLabels=header.colLabels,
     )
 
 
-def patch_heads(model: LanguageModel, patching_request: PatchRequest):
-    components = [layer.attn.o_proj for layer in model.model.layers]
+class Attribution(NamedTuple):
+    source_acts: list
+    destination_acts: list
+    grads: list
+    source_diff: Optional[float]
+    destination_value: float
+
+
+def get_attribution(
+    model: LanguageModel, patching_request: PatchRequest, get_activations
+) -> Attribution:
+    """Cache activations and gradients for attribution patching.
+
+    Costs one clean forward pass, one corrupted forward pass, and one backward
+    pass. ``get_activations()`` is called inside both traces and returns the
+    activations to patch, in execution order.
+    """
+    has_diff = patching_request.incorrect_id is not None
+
+    with model.trace(patching_request.source):
+        source_acts = get_activations().save()
+
+        if has_diff:
+            source_diff = logit_difference(model, patching_request).save()
+
+    with model.trace(patching_request.destination):
+        destination_acts = get_activations().save()
+
+        if has_diff:
+            destination_value = logit_difference(model, patching_request)
+        else:
+            destination_value = get_prob(model, patching_request)
+
+        # Gradients must be requested in reverse execution order
+        with destination_value.backward():
+            grads = [act.grad for act in reversed(destination_acts)][::-1]
+
+        grads.save()
+        destination_value.save()
+
+    return Attribution(
+        source_acts=source_acts,
+        destination_acts=destination_acts,
+        grads=grads,
+        source_diff=source_diff.item() if has_diff else None,
+        destination_value=destination_value.item(),
+    )
+
+
+def attribute(
+    attribution: Attribution,
+    layer_idx: int,
+    source_idxs: List[int] | slice = slice(None),
+    destination_idxs: List[int] | slice = slice(None),
+) -> t.Tensor:
+    """Elementwise (source - destination) * grad for the given positions."""
+    source = attribution.source_acts[layer_idx][0, source_idxs].detach().float()
+    destination = (
+        attribution.destination_acts[layer_idx][0, destination_idxs].detach().float()
+    )
+    grad = attribution.grads[layer_idx][0, destination_idxs].float()
+
+    return (source - destination) * grad
+
+
+def attribution_metric(
+    patching_request: PatchRequest, attribution: Attribution, estimate: t.Tensor
+) -> t.Tensor:
+    """Convert first-order estimates of the metric change into patching results."""
+    if patching_request.incorrect_id is not None:
+        return compute_ioi_metric(
+            attribution.source_diff,
+            attribution.destination_value,
+            attribution.destination_value + estimate,
+        )
+
+    return attribution.destination_value + estimate
+
+
+def patch_components(
+    model: LanguageModel,
+    patching_request: PatchRequest,
+    cancel: Optional[CancellationToken] = None,
+) -> Iterator[PatchEvent]:
+    components = get_components(model, patching_request)
+    layer_idxs = list(range(len(components)))
+
+    def cache_source():
+        return [get_hidden(component.output) for component in components]
 
-    source_cache = {}
+    yield PatchHeader()
+
+    if patching_request.method == "attribution":
+        attribution = get_attribution(model, patching_request, cache_source)
+        # Each layer's estimate sits on that layer's device
+        estimate = t.stack(
+            [attribute(attribution, layer_idx).sum().cpu() for layer_idx in layer_idxs]
+        )
+        results = attribution_metric(patching_request, attribution, estimate)
+        values = enumerate(results.tolist())
+    else:
+        values = sweep_components(model, patching_request, components, cache_source)
+
+    yield from assemble_rows(
+        values,
+        layer_idxs,
+        layer_row,
+        cancel,
+    )
+
+
+def sweep_components(
+    model: LanguageModel, patching_request: PatchRequest, components, cache_source
+) -> Iterator[Tuple[int, float]]:
+    baseline = get_baseline(model, patching_request, cache_source)
+
+    # Each batch row is a copy of the destination with one layer patched
+    layer_idxs = list(range(len(components)))
+    for chunk in chunked(layer_idxs, patching_request.chunk_size):
+        with model.trace([patching_request.destination] * len(chunk)):
+            resume_from(model, baseline, chunk[0], len(chunk))
+
+            for row, layer_idx in enumerate(chunk):
+                hidden_BLD = get_hidden(components[layer_idx].output)
+                hidden_BLD[row] = baseline.source_cache[layer_idx][0]
+
+            metric_B = batched_metric(model, patching_request, baseline).save()
+
+        yield from zip(chunk, metric_B.tolist())
+
+
+def split_heads(hidden_BLD, n_heads: int):
+    return einops.rearrange(
+        hidden_BLD,
+        "b l (n_heads d_head) -> b l n_heads d_head",
+        n_heads=n_heads,
+    )
+
+
+def merge_heads(hidden_BLHDh):
+    return einops.rearrange(
+        hidden_BLHDh,
+        "b l n_heads d_head -> b l (n_heads d_head)",
+    )
+
+
+def patch_heads(
+    model: LanguageModel,
+    patching_request: PatchRequest,
+    cancel: Optional[CancellationToken] = None,
+) -> Iterator[PatchEvent]:
+    components = [layer.attn.o_proj for layer in model.model.layers]
     n_heads = model.config.n_heads
 
-    with model.wrapped_session():
-        results = ns.dict().save()
+    # Row-major (layer, head) cells
+    cells = [
+        (layer_idx, head_idx)
+        for layer_idx in range(len(components))
+        for head_idx in range(n_heads)
+    ]
 
-        # Cache source activations
-        with model.trace(patching_request.source):
-            for component in components:
-                hidden_BLD = component.input
-                hidden_BLHDh = einops.rearrange(
-                    hidden_BLD,
-                    "b l (n_heads d_head) -> b l n_heads d_head",
+    yield PatchHeader(
+        rowLabels=[layer for layer in range(len(components))],
+        colLabels=[head for head in range(n_heads)],
+    )
+
+    if patching_request.method == "attribution":
+        # Gradients flow through the unsplit o_proj input
+        attribution = get_attribution(
+            model,
+            patching_request,
+            lambda: [component.input for component in components],
+        )
+        # Each layer's estimate sits on that layer's device
+        estimate_NH = t.stack(
+            [
+                einops.reduce(
+                    attribute(attribution, layer_idx),
+                    "l (n_heads d_head) -> n_heads",
+                    "sum",
                     n_heads=n_heads,
+                ).cpu()
+                for layer_idx in range(len(components))
+            ]
+        )
+        results = attribution_metric(patching_request, attribution, estimate_NH)
+        values = enumerate(results.flatten().tolist())
+    else:
+        values = sweep_heads(model, patching_request, components, cells)
+
+    yield from assemble_rows(
+        values,
+        [layer_idx for layer_idx, _ in cells],
+        layer_row,
+        cancel,
+    )
+
+
+def sweep_heads(
+    model: LanguageModel, patching_request: PatchRequest, components, cells
+) -> Iterator[Tuple[int, float]]:
+    n_heads = model.config.n_heads
+
+    def cache_source():
+        return [split_heads(component.input, n_heads) for component in components]
+
+    baseline = get_baseline(model, patching_request, cache_source)
+
+    # Each batch row is a copy of the destination with one (layer, head) patched
+    cell_idxs = list(range(len(cells)))
+    for chunk_idxs in chunked(cell_idxs, patching_request.chunk_size):
+        chunk = [cells[cell_idx] for cell_idx in chunk_idxs]
+
+        # Build a per-row head mask for every layer touched by this chunk
+        head_masks = {}
+        for row, (layer_idx, head_idx) in enumerate(chunk):
+            if layer_idx not in head_masks:
+                head_masks[layer_idx] = t.zeros(len(chunk), n_heads, dtype=t.bool)
+            head_masks[layer_idx][row, head_idx] = True
+
+        with model.trace([patching_request.destination] * len(chunk)):
+            resume_from(model, baseline, chunk[0][0], len(chunk))
+
+            for layer_idx, head_mask_BH in head_masks.items():
+                component = components[layer_idx]
+                hidden_BLHDh = split_heads(component.input, n_heads)
+
+                mask_B1H1 = head_mask_BH[:, None, :, None].to(hidden_BLHDh.device)
+                hidden_BLHDh = t.where(
+                    mask_B1H1, baseline.source_cache[layer_idx], hidden_BLHDh
                 )
 
-                for head_idx in range(n_heads):
-                    source_cache[(component, head_idx)] = hidden_BLHDh[
-                        :, :, head_idx, :
-                    ]
-
-                if patching_request.incorrect_id is not None:
-                    source_diff = logit_difference(model, patching_request)
-
-        with model.trace(patching_request.destination):
-            destination_diff = logit_difference(model, patching_request)
-
-        for layer_idx, component in enumerate(components):
-            for head_idx in range(n_heads):
-                with model.trace(patching_request.destination):
-                    hidden_BLD = component.input
-                    hidden_BLHDh = einops.rearrange(
-                        hidden_BLD,
-                        "b l (n_heads d_head) -> b l n_heads d_head",
-                        n_heads=n_heads,
-                    )
-
-                    hidden_BLHDh[:, :, head_idx, :] = source_cache[
-                        (component, head_idx)
-                    ]
-
-                    hidden_BLD = einops.rearrange(
-                        hidden_BLHDh,
-                        "b l n_heads d_head -> b l (n_heads d_head)",
-                    )
-
-                    component.input = hidden_BLD
-
-                    if patching_request.incorrect_id is not None:
-                        patched_diff = logit_difference(model, patching_request)
-                        ioi_metric = compute_ioi_metric(
-                            source_diff, destination_diff, patched_diff
-                        )
-                        results[(layer_idx, head_idx)] = ioi_metric
-                    else:
-                        prob = get_prob(model, patching_request)
-                        results[(layer_idx, head_idx)] = prob
-
-    results_grid = []
-    for layer_idx in range(len(components)):
-        results_grid.append([])
-        for head_idx in range(n_heads):
-            results_grid[layer_idx].append(results[(layer_idx, head_idx)])
+                component.input = merge_heads(hidden_BLHDh)
 
-    return PatchResponse(
-        results=results_grid,
-        rowLabels=[layer for layer in range(len(components))],
-        colLabels=[head for head in range(n_heads)],
+            metric_B = batched_metric(model, patching_request, baseline).save()
+
+        yield from zip(chunk_idxs, metric_B.tolist())
+
+
+class PatchCell(NamedTuple):
+    layer_idx: int
+    destination_idx: int
+    source_idx: int
+
+
+def group_by_layer(cells: List[PatchCell]):
+    """Map each layer to the (rows, destination idxs, source idxs) patched in it."""
+    groups = {}
+    for row, cell in enumerate(cells):
+        rows, destination_idxs, source_idxs = groups.setdefault(
+            cell.layer_idx, ([], [], [])
+        )
+        rows.append(row)
+        destination_idxs.append(cell.destination_idx)
+        source_idxs.append(cell.source_idx)
+
+    return groups
+
+
+def patch_positions(
+    model: LanguageModel,
+    patching_request: PatchRequest,
+    components,
+    baseline: PatchBaseline,
+    cells: List[PatchCell],
+) -> Iterator[Tuple[int, float]]:
+    """Patch single token positions, one cell per batch row.
+
+    ``cells`` must be ordered by layer so each chunk touches the components
+    in execution order.
+    """
+    if baseline.prefix_cache is not None:
+        yield from patch_suffixes(
+            model, patching_request, components, baseline, cells
+        )
+        return
+
+    cell_idxs = list(range(len(cells)))
+    for chunk_idxs in chunked(cell_idxs, patching_request.chunk_size):
+        chunk = [cells[cell_idx] for cell_idx in chunk_idxs]
+
+        with model.trace([patching_request.destination] * len(chunk)):
+            resume_from(model, baseline, chunk[0].layer_idx, len(chunk))
+
+            for layer_idx, (rows, destination_idxs, source_idxs) in group_by_layer(
+                chunk
+            ).items():
+                hidden_BLD = get_hidden(components[layer_idx].output)
+                hidden_BLD[rows, destination_idxs] = baseline.source_cache[
+                    layer_idx
+                ][0, source_idxs]
+
+            metric_B = batched_metric(model, patching_request, baseline).save()
+
+        yield from zip(chunk_idxs, metric_B.tolist())
+
+
+def patch_suffixes(
+    model: LanguageModel,
+    patching_request: PatchRequest,
+    components,
+    baseline: PatchBaseline,
+    cells: List[PatchCell],
+) -> Iterator[Tuple[int, float]]:
+    """Patch single token positions, reusing the destination KV cache.
+
+    With causal attention, positions before the patched one are unchanged, so
+    each chunk only runs the tokens from its earliest patched position
+    onwards. Each layer is chunked on its own, nearby positions sharing a
+    chunk, so no chunk mixes the late positions of one layer with the early
+    ones of the next, and rows still finish, and stream, one layer at a time.
+    """
+    destination_ids = model.tokenizer(
+        patching_request.destination, return_tensors="pt"
+    )["input_ids"][0]
+
+    cell_idxs = sorted(
+        range(len(cells)),
+        key=lambda cell_idx: (cells[cell_idx].layer_idx, cells[cell_idx].destination_idx),
     )
+    layer_chunks = chain.from_iterable(
+        chunked(list(layer_cell_idxs), patching_request.chunk_size)
+        for _, layer_cell_idxs in groupby(
+            cell_idxs, key=lambda cell_idx: cells[cell_idx].layer_idx
+        )
+    )
+
+    for chunk_idxs in layer_chunks:
+        chunk = [cells[cell_idx] for cell_idx in chunk_idxs]
+        start = min(cell.destination_idx for cell in chunk)
 
+        if start == 0:
+            # Nothing to reuse, run the full prompt
+            inputs, kwargs = [patching_request.destination] * len(chunk), {}
+        else:
+            inputs, past_key_values = get_prefix_inputs(
+                destination_ids, baseline.prefix_cache, start, len(chunk)
+            )
+            kwargs = {"past_key_values": past_key_values}
+
+        with model.trace(inputs, **kwargs):
+            resume_from(model, baseline, chunk[0].layer_idx, len(chunk), start)
+
+            for layer_idx, (rows, destination_idxs, source_idxs) in group_by_layer(
+                chunk
+            ).items():
+                # Positions are relative to the start of the suffix
+                hidden_BLD = get_hidden(components[layer_idx].output)
+                hidden_BLD[rows, [idx - start for idx in destination_idxs]] = (
+                    baseline.source_cache[layer_idx][0, source_idxs]
+                )
+
+            metric_B = batched_metric(model, patching_request, baseline).save()
+
+        yield from zip(chunk_idxs, metric_B.tolist())
+
+
+def attribute_positions(
+    model: LanguageModel,
+    patching_request: PatchRequest,
+    cells: List[PatchCell],
+    get_activations,
+) -> Iterator[Tuple[int, float]]:
+    """Estimate every position cell with attribution patching."""
+    attribution = get_attribution(model, patching_request, get_activations)
+
+    estimate = t.empty(len(cells))
+    for layer_idx, (rows, destination_idxs, source_idxs) in group_by_layer(
+        cells
+    ).items():
+        contribution_XD = attribute(
+            attribution, layer_idx, source_idxs, destination_idxs
+        )
+        estimate[rows] = contribution_XD.sum(dim=-1).cpu()
+
+    results = attribution_metric(patching_request, attribution, estimate)
+    yield from enumerate(results.tolist())
+
+
+def sweep_positions(
+    model: LanguageModel,
+    patching_request: PatchRequest,
+    components,
+    cells: List[PatchCell],
+    cache_source,
+) -> Iterator[Tuple[int, float]]:
+    if patching_request.method == "attribution":
+        yield from attribute_positions(model, patching_request, cells, cache_source)
+        return
 
-def patch_tokens(model: LanguageModel, patching_request: PatchRequest):
+    baseline = get_baseline(model, patching_request, cache_source)
+    yield from patch_positions(model, patching_request, components, baseline, cells)
+
+
+def patch_tokens(
+    model: LanguageModel,
+    patching_request: PatchRequest,
+    token_table: TokenTable,
+    cancel: Optional[CancellationToken] = None,
+) -> Iterator[PatchEvent]:
     components = get_components(model, patching_request)
-    is_tuple = patching_request.submodule == "blocks"
 
     # Compute n_tokens
     destination_prompt = patching_request.destination
     destination_tokens = model.tokenizer.encode(destination_prompt)
     n_tokens = len(destination_tokens)
 
-    source_cache = {}
-
-    with model.wrapped_session():
-        results = ns.dict().save()
-
-        with model.trace(patching_request.source):
-            for component in components:
-                hidden_BLD = component.output
-
-                if is_tuple:
-                    hidden_BLD = hidden_BLD[0]
-
-                for token_idx in range(n_tokens):
-                    source_cache[(component, token_idx)] = hidden_BLD[
-                        :, token_idx, :
-                    ]
-
-            if patching_request.incorrect_id is not None:
-                source_diff = logit_difference(model, patching_request)
-
-        with model.trace(patching_request.destination):
-            destination_diff = logit_difference(model, patching_request)
-
-        for layer_idx, component in enumerate(components):
-            ns.log(f"Patching layer {layer_idx}")
-            for token_idx in range(n_tokens):
-                with model.trace(destination_prompt):
-                    if is_tuple:
-                        hidden_BLD_tuple = component.output
-                        hidden_BLD = hidden_BLD_tuple[0]
-
-                        hidden_BLD[:, token_idx, :] = source_cache[
-                            (component, token_idx)
-                        ]
-                        component.output = (hidden_BLD, hidden_BLD_tuple[1])
-
-                    else:
-                        hidden_BLD = component.output
-
-                        hidden_BLD[:, token_idx, :] = source_cache[
-                            (component, token_idx)
-                        ]
-                        component.output = hidden_BLD
-
-                    if patching_request.incorrect_id is not None:
-                        patched_diff = logit_difference(model, patching_request)
-                        ioi_metric = compute_ioi_metric(
-                            source_diff, destination_diff, patched_diff
-                        )
-                        results[(layer_idx, token_idx)] = ioi_metric
-                    else:
-                        prob = get_prob(model, patching_request)
-                        results[(layer_idx, token_idx)] = prob.item()
-
-    results_grid = []
-    for layer_idx in range(len(components)):
-        results_grid.append([])
-        for token_idx in range(n_tokens):
-            results_grid[layer_idx].append(results[(layer_idx, token_idx)])
+    destination_token_ids = token_table.decode(destination_tokens)
 
-    destination_token_ids = [
-        model.tokenizer.decode(token) for token in destination_tokens
-    ]
-
-    return PatchResponse(
-        results=results_grid,
+    yield PatchHeader(
         rowLabels=[layer for layer in range(len(components))],
         colLabels=destination_token_ids,
     )
 
+    def cache_source():
+        return [get_hidden(component.output) for component in components]
+
+    cells = [
+        PatchCell(layer_idx, token_idx, token_idx)
+        for layer_idx in range(len(components))
+        for token_idx in range(n_tokens)
+    ]
+    values = sweep_positions(model, patching_request, components, cells, cache_source)
+
+    yield from assemble_rows(
+        values,
+        [cell.layer_idx for cell in cells],
+        layer_row,
+        cancel,
+    )
 
-from typing import NamedTuple
 
 class PatchingIdxs(NamedTuple):
     source: List[int]
@@ -396,9 +870,12 @@ def get_sync_x_labels(
     return x_labels, x_items
 
 
-def patch_tokens_sync(model: LanguageModel, patching_request: PatchRequest):
+def patch_tokens_sync(
+    model: LanguageModel,
+    patching_request: PatchRequest,
+    cancel: Optional[CancellationToken] = None,
+) -> Iterator[PatchEvent]:
     components = get_components(model, patching_request)
-    is_tuple = patching_request.submodule == "blocks"
 
     connections = [
         edit for edit in patching_request.edits if isinstance(edit, Connection)
@@ -411,159 +888,259 @@ def patch_tokens_sync(model: LanguageModel, patching_request: PatchRequest):
         patching_request.destination,
     )
 
-    source_cache = {}
+    x_labels, x_items = get_sync_x_labels(
+        connections, patching_request.destination, model.tokenizer
+    )
+
+    yield PatchHeader(
+        rowLabels=[layer for layer in range(len(components))],
+        colLabels=x_labels,
+    )
+
+    def cache_source():
+        return [get_hidden(component.output) for component in components]
 
-    with model.wrapped_session():
-        results = ns.dict().save()
+    cells = []
+    for layer_idx in range(len(components)):
+        # Patch tokens
+        for token_idx in patching_idxs.destination:
+            cells.append(
+                PatchCell(layer_idx, token_idx, patching_idxs.tok_map[token_idx])
+            )
+
+        # Patch connections from the last start token into the last end token
+        for connection in connections:
+            cells.append(
+                PatchCell(
+                    layer_idx,
+                    connection.end.token_indices[-1],
+                    connection.start.token_indices[-1],
+                )
+            )
+
+    def make_row(layer_idx, row_values):
+        results = {
+            cells[cell_idx].destination_idx: value
+            for cell_idx, value in row_values.items()
+        }
+        return PatchRow(
+            row=layer_idx,
+            label=layer_idx,
+            results=[results[x_item] for x_item in x_items],
+        )
 
-        with model.trace(patching_request.source):
-            for component in components:
-                hidden_BLD = component.output
+    values = sweep_positions(model, patching_request, components, cells, cache_source)
 
-                if is_tuple:
-                    hidden_BLD = hidden_BLD[0]
+    yield from assemble_rows(
+        values, [cell.layer_idx for cell in cells], make_row, cancel
+    )
 
-                # Cache source activations for connections
-                for connection in connections:
-                    start_token_last_idx = connection.start.token_indices[-1]
 
-                    source_cache[(component, connection)] = hidden_BLD[
-                        :, start_token_last_idx, :
-                    ]
+def patch_tokens_async(model: LanguageModel, patching_request: PatchRequest):
+    pass
+    # components = get_components(model, patching_request)
 
-                # Cache source activations for tokens
-                for token_idx in patching_idxs.source:
-                    source_cache[(component, token_idx)] = hidden_BLD[
-                        :, token_idx, :
-                    ]
+    # source_cache = {}
 
-            if patching_request.incorrect_id is not None:
-                source_diff = logit_difference(model, patching_request)
+    # with model.wrapped_session(job_id=patching_request.job_id):
+    #     with model.trace(patching_request.source):
+    #         for component in components:
+    #             hidden_BLD = component.output
 
-        with model.trace(patching_request.destination):
-            destination_diff = logit_difference(model, patching_request)
 
-        for layer_idx, component in enumerate(components):
-            # Patch tokens
-            for token_idx in patching_idxs.destination:
-                with model.trace(patching_request.destination):
-                    if is_tuple:
-                        hidden_BLD_tuple = component.output
+router = APIRouter()
 
-                        hidden_BLD = hidden_BLD_tuple[0]
 
-                    else:
-                        hidden_BLD = component.output
+def get_patch_events(
+    model: LanguageModel,
+    patching_request: PatchRequest,
+    token_table: TokenTable,
+    cancel: Optional[CancellationToken] = None,
+):
+    """Pick the sweep for a request. Returns a generator of patch events."""
+    if patching_request.patch_tokens:
+        has_connections = any(
+            isinstance(edit, Connection) for edit in patching_request.edits
+        )
 
-                    # Patch in the token
-                    hidden_BLD[:, token_idx, :] = source_cache[
-                        (component, patching_idxs.tok_map[token_idx])
-                    ]
+        if has_connections:
+            return patch_tokens_sync(model, patching_request, cancel)
 
-                    # Set new output
-                    if is_tuple:
-                        component.output = (hidden_BLD, hidden_BLD_tuple[1])
+        return patch_tokens(model, patching_request, token_table, cancel)
 
-                    else:
-                        component.output = hidden_BLD
+    if patching_request.submodule == "heads":
+        return patch_heads(model, patching_request, cancel)
 
-                    if patching_request.incorrect_id is not None:
-                        patched_diff = logit_difference(model, patching_request)
-                        ioi_metric = compute_ioi_metric(
-                            source_diff, destination_diff, patched_diff
-                        )
-                        results[(layer_idx, token_idx)] = ioi_metric
-                    else:
-                        prob = get_prob(model, patching_request)
-                        results[(layer_idx, token_idx)] = prob
+    return patch_components(model, patching_request, cancel)
 
-            # Patch connections
-            for connection in connections:
-                with model.trace(patching_request.destination):
-                    if is_tuple:
-                        hidden_BLD_tuple = component.output
 
-                        hidden_BLD = hidden_BLD_tuple[0]
+def sweep_patch_events(
+    state,
+    patching_request: PatchRequest,
+    cancel: Optional[CancellationToken] = None,
+) -> Iterator[PatchEvent]:
+    model = state.get_model(patching_request.model)
+    token_table = state.get_tokens(patching_request.model)
+    return get_patch_events(model, patching_request, token_table, cancel)
+
+
+def schedule_patch_events(
+    state,
+    patching_request: PatchRequest,
+    cancel: Optional[CancellationToken] = None,
+) -> AsyncIterator[PatchEvent]:
+    """Run a sweep through the model's job queue, one layer row per slot."""
+    return state.scheduler.iterate(
+        patching_request.model,
+        sweep_patch_events,
+        state,
+        patching_request,
+        cancel,
+        priority=Priority.SWEEP,
+    )
 
-                    else:
-                        hidden_BLD = component.output
 
-                    end_token_last_idx = connection.end.token_indices[-1]
+async def run_patch(
+    state,
+    patching_request: PatchRequest,
+    cancel: Optional[CancellationToken] = None,
+) -> PatchResponse:
+    events = [
+        event async for event in schedule_patch_events(state, patching_request, cancel)
+    ]
+    return collect_patch_response(iter(events))
+
+
+def patch_cache_key(patching_request: PatchRequest) -> str:
+    """Canonical hash of every request field that changes the result.
+
+    Execution knobs like chunkSize or resumeLayers are left out since they
+    produce the same grid.
+    """
+    return canonical_key(
+        patching_request.model_dump(
+            by_alias=True,
+            include={
+                "model",
+                "source",
+                "destination",
+                "edits",
+                "submodule",
+                "patch_tokens",
+                "correct_id",
+                "incorrect_id",
+                "method",
+            },
+        )
+    )
 
-                    hidden_BLD[:, end_token_last_idx, :] = source_cache[
-                        (component, connection)
-                    ]
 
-                    # Set new output
-                    if is_tuple:
-                        component.output = (hidden_BLD, hidden_BLD_tuple[1])
+def replay_patch_response(response: PatchResponse) -> Iterator[PatchEvent]:
+    """Turn a finished PatchResponse back into a patch event stream."""
+    yield PatchHeader(rowLabels=response.rowLabels, colLabels=response.colLabels)
 
-                    else:
-                        component.output = hidden_BLD
+    for row_idx, results in enumerate(response.results):
+        label = response.rowLabels[row_idx] if response.rowLabels else row_idx
+        yield PatchRow(row=row_idx, label=label, results=results)
 
-                    if patching_request.incorrect_id is not None:
-                        patched_diff = logit_difference(model, patching_request)
-                        ioi_metric = compute_ioi_metric(
-                            source_diff, destination_diff, patched_diff
-                        )
-                        results[(layer_idx, end_token_last_idx)] = ioi_metric
-                    else:
-                        prob = get_prob(model, patching_request)
-                        results[(layer_idx, end_token_last_idx)] = prob
 
-    x_labels, x_items = get_sync_x_labels(
-        connections, patching_request.destination, model.tokenizer
-    )
+def patch_columns(response: PatchResponse) -> dict:
+    """Columnar patch grid: results is rows x columns."""
+    return {
+        "rowLabels": response.rowLabels,
+        "colLabels": response.colLabels,
+        "results": t.tensor(response.results),
+    }
 
-    results_grid = []
-    for layer_idx in range(len(components)):
-        results_grid.append([])
-        for x_item in x_items:
-            results_grid[layer_idx].append(results[(layer_idx, x_item)])
 
-    return PatchResponse(
-        results=results_grid,
-        rowLabels=[layer for layer in range(len(components))],
-        colLabels=x_labels,
+def log_cancelled(state, user_email: str, patching_request: PatchRequest):
+    TelemetryClient.log_request(
+        state,
+        RequestStatus.CANCELLED,
+        user_email,
+        method="PATCH",
+        type=patching_request.submodule.upper(),
     )
 
 
-def patch_tokens_async(model: LanguageModel, patching_request: PatchRequest):
-    pass
-    # components = get_components(model, patching_request)
+@router.post("/patch-grid")
+async def patch(
+    patching_request: PatchRequest,
+    request: Request,
+    user_email: str = Depends(require_user_email),
+    encoding: str | None = Depends(negotiate_encoding),
+):
+    state = request.app.state.m
 
-    # source_cache = {}
+    cache_key = patch_cache_key(patching_request)
+    cached = state.patch_cache.get(cache_key)
 
-    # with model.wrapped_session(job_id=patching_request.job_id):
-    #     with model.trace(patching_request.source):
-    #         for component in components:
-    #             hidden_BLD = component.output
+    if cached is not None:
+        response = PatchResponse(**cached)
+    else:
+        # Queue the sweep on the model, stopping it if the client leaves
+        cancel = CancellationToken()
+        task = asyncio.create_task(run_patch(state, patching_request, cancel))
 
+        while not task.done():
+            if await request.is_disconnected():
+                cancel.cancel()
+                break
 
-router = APIRouter()
+            await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
 
+        try:
+            response = await task
+        except JobCancelled:
+            log_cancelled(state, user_email, patching_request)
+            # Nginx's "client closed request", nobody is listening anyway
+            return Response(status_code=499)
 
-@router.post("/patch-grid")
-async def patch(patching_request: PatchRequest, request: Request):
-    state = request.app.state.m
-    model = state.get_model(patching_request.model)
+        state.patch_cache.put(cache_key, response.model_dump())
 
-    if patching_request.patch_tokens:
-        has_connections = any(
-            isinstance(edit, Connection) for edit in patching_request.edits
-        )
+    if encoding is not None:
+        return encode_columns(patch_columns(response), encoding)
 
-        if has_connections:
-            # Run blocking operation in thread pool
-            return await asyncio.to_thread(patch_tokens_sync, model, patching_request)
+    return response
 
-        # Run blocking operation in thread pool
-        return await asyncio.to_thread(patch_tokens, model, patching_request)
 
-    else:
-        if patching_request.submodule == "heads":
-            # Run blocking operation in thread pool
-            return await asyncio.to_thread(patch_heads, model, patching_request)
+@router.post("/patch-grid-stream")
+async def patch_stream(
+    patching_request: PatchRequest,
+    request: Request,
+    user_email: str = Depends(require_user_email),
+):
+    """Stream the patch grid as NDJSON: a header frame, then one frame per layer row."""
+    state = request.app.state.m
 
-        # Run blocking operation in thread pool
-        return await asyncio.to_thread(patch_components, model, patching_request)
+    cache_key = patch_cache_key(patching_request)
+    cached = state.patch_cache.get(cache_key)
+    cancel = CancellationToken()
+
+    async def frames():
+        if cached is not None:
+            for event in replay_patch_response(PatchResponse(**cached)):
+                yield event.model_dump_json() + "\n"
+            return
+
+        seen = []
+        try:
+            async for event in schedule_patch_events(state, patching_request, cancel):
+                seen.append(event)
+                yield event.model_dump_json() + "\n"
+        except (asyncio.CancelledError, GeneratorExit):
+            # Starlette tears down the response when the client disconnects
+            cancel.cancel()
+            log_cancelled(state, user_email, patching_request)
+            raise
+
+        # Only cache sweeps the client read to the end
+        response = collect_patch_response(iter(seen))
+        state.patch_cache.put(cache_key, response.model_dump())
+
+    return StreamingResponse(frames(), media_type="application/x-ndjson")
+
+
+@router.get("/cache-stats")
+async def cache_stats(request: Request):
+    return request.app.state.m.patch_cache.stats()
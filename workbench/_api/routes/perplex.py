@@ -7,6 +7,7 @@ import logging
 from ..state import AppState, get_state
 from ..data_models import NDIFResponse
 from ..auth import require_user_email
+from ..batching import prompt_length
 
 logger = logging.getLogger(__name__)
 
@@ -51,15 +52,7 @@ def calculate_token_probabilities(
     """
     model = state[model_name]
     tokenizer = model.tokenizer
-    
-    # Tokenize prompt and output separately
-    prompt_ids = tokenizer.encode(prompt, return_tensors="pt")
-    if prompt_ids.dim() == 2:
-        prompt_ids = prompt_ids[0]
-    
-    output_ids = tokenizer.encode(output, return_tensors="pt")
-    if output_ids.dim() == 2:
-        output_ids = output_ids[0]
+    token_table = state.get_tokens(model_name)
     
     # For remote execution, we need to handle this differently
     if state.remote:
@@ -77,38 +70,118 @@ def calculate_token_probabilities(
         logits_BLV = model.output.logits
         logits_BLV.save()
     
-    # Remove batch dimension
-    logits_LV = logits_BLV[0]
-    prompt_len = prompt_ids.size(0)
-    vocab_size = logits_LV.size(-1)
-    
-    prompt_token_data = []
-    output_token_data = []
-    
     # For the first token, we need to use BOS token to get initial predictions
-    # Get the BOS token ID if it exists, otherwise use an empty tensor approach
-    bos_token_id = tokenizer.bos_token_id if tokenizer.bos_token_id is not None else tokenizer.eos_token_id
+    bos_token_id = get_bos_token_id(tokenizer)
     
     if bos_token_id is not None:
         # Trace with just the BOS token to get predictions for the first position
-        bos_ids = t.tensor([[bos_token_id]])
-        with model.trace(tokenizer.decode([bos_token_id]), remote=False) as bos_tracer:
+        with model.trace(token_table[bos_token_id], remote=False) as bos_tracer:
             bos_logits_BLV = model.output.logits
             bos_logits_BLV.save()
-        bos_logits_available = True
+        bos_logits_V = bos_logits_BLV[0, 0]
     else:
-        bos_logits_available = False
+        bos_logits_V = None
+    
+    # Remove batch dimension
+    return score_tokens(
+        model_name, prompt, output, logits_BLV[0], bos_logits_V, state, top_k
+    )
+
+
+def calculate_token_probabilities_batch(
+    reqs: List[PerplexRequest], state: AppState
+) -> List[tuple[List[TokenProbability], List[TokenProbability], int]]:
+    """
+    Calculate token probabilities for several requests in one right-padded
+    trace. The BOS prediction is shared, as one more row of the batch.
+    """
+    if len(reqs) == 1:
+        req = reqs[0]
+        return [
+            calculate_token_probabilities(
+                req.model, req.prompt, req.output, state, req.top_k
+            )
+        ]
+
+    model_name = reqs[0].model
+    model = state[model_name]
+    tokenizer = model.tokenizer
+    token_table = state.get_tokens(model_name)
+
+    texts = [req.prompt + req.output for req in reqs]
+    bos_token_id = get_bos_token_id(tokenizer)
+    if bos_token_id is not None:
+        texts.append(token_table[bos_token_id])
+
+    # Right padding keeps every text's positions where they'd be alone
+    inputs = tokenizer(texts, padding=True, padding_side="right", return_tensors="pt")
+    lengths = inputs["attention_mask"].sum(dim=-1).tolist()
+
+    with model.trace({**inputs}, remote=False) as tracer:
+        logits_BLV = model.output.logits
+        logits_BLV.save()
+
+    bos_logits_V = logits_BLV[-1, 0] if bos_token_id is not None else None
+
+    return [
+        score_tokens(
+            model_name,
+            req.prompt,
+            req.output,
+            logits_BLV[row, : lengths[row]],
+            bos_logits_V,
+            state,
+            req.top_k,
+        )
+        for row, req in enumerate(reqs)
+    ]
+
+
+def get_bos_token_id(tokenizer) -> Optional[int]:
+    # Get the BOS token ID if it exists, otherwise fall back to EOS
+    return tokenizer.bos_token_id if tokenizer.bos_token_id is not None else tokenizer.eos_token_id
+
+
+def score_tokens(
+    model_name: str,
+    prompt: str,
+    output: str,
+    logits_LV: t.Tensor,
+    bos_logits_V: Optional[t.Tensor],
+    state: AppState,
+    top_k: int = 3
+) -> tuple[List[TokenProbability], List[TokenProbability], int]:
+    """
+    Probability, rank and top alternatives of every prompt and output token,
+    from the logits of tracing the prompt followed by the output.
+    """
+    tokenizer = state[model_name].tokenizer
+    token_table = state.get_tokens(model_name)
+    
+    # Tokenize prompt and output separately
+    prompt_ids = tokenizer.encode(prompt, return_tensors="pt")
+    if prompt_ids.dim() == 2:
+        prompt_ids = prompt_ids[0]
+    
+    output_ids = tokenizer.encode(output, return_tensors="pt")
+    if output_ids.dim() == 2:
+        output_ids = output_ids[0]
+    
+    prompt_len = prompt_ids.size(0)
+    vocab_size = logits_LV.size(-1)
+    
+    prompt_token_data = []
+    output_token_data = []
     
     # Calculate probabilities for all prompt tokens
     for i, token_id in enumerate(prompt_ids):
         token_id_int = token_id.item()
-        token_str = tokenizer.decode([token_id_int])
+        token_str = token_table[token_id_int]
         
         if i == 0:
-            if bos_logits_available:
+            if bos_logits_V is not None:
                 # Get predictions from position after BOS
-                bos_logits = bos_logits_BLV[0, 0]
-                probabilities = t.softmax(bos_logits, dim=-1)
+                probabilities = t.softmax(bos_logits_V, dim=-1)
             else:
                 # If no BOS token, skip the first token (can't predict without context)
                 continue
@@ -122,7 +195,7 @@ def calculate_token_probabilities(
         
         # Get top k alternatives first
         top_k_probs, top_k_indices = t.topk(probabilities, min(top_k, vocab_size))
-        top_k_tokens = [tokenizer.decode([idx.item()]) for idx in top_k_indices]
+        top_k_tokens = token_table.decode(top_k_indices)
         
         top_alternatives = [
             {"token": token, "probability": prob.item()}
@@ -163,11 +236,11 @@ def calculate_token_probabilities(
         actual_prob = probabilities[token_id].item()
         
         # Get token string
-        token_str = tokenizer.decode([token_id])
+        token_str = token_table[token_id]
         
         # Get top k alternatives first
         top_k_probs, top_k_indices = t.topk(probabilities, min(top_k, vocab_size))
-        top_k_tokens = [tokenizer.decode([idx.item()]) for idx in top_k_indices]
+        top_k_tokens = token_table.decode(top_k_indices)
         
         top_alternatives = [
             {"token": token, "probability": prob.item()}
@@ -208,9 +281,25 @@ async def calculate_probabilities(
     Calculate token probabilities for a given prompt and output.
     """
     try:
-        prompt_tokens, output_tokens, vocab_size = calculate_token_probabilities(
-            req.model, req.prompt, req.output, state, req.top_k
-        )
+        if state.remote:
+            prompt_tokens, output_tokens, vocab_size = await state.scheduler.run(
+                req.model,
+                calculate_token_probabilities,
+                req.model,
+                req.prompt,
+                req.output,
+                state,
+                req.top_k,
+            )
+        else:
+            # Shares a forward pass with concurrent requests on the model
+            prompt_tokens, output_tokens, vocab_size = await state.batcher.run(
+                req.model,
+                calculate_token_probabilities_batch,
+                req,
+                state,
+                prompt_length(state, req.model, req.prompt + req.output),
+            )
         
         return {
             "data": PerplexData(
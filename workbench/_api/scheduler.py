@@ -0,0 +1,291 @@
+import asyncio
+import heapq
+import itertools
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Iterator, TypeVar
+
+from .cancellation import CancellationToken
+
+if TYPE_CHECKING:
+    from .workers import ModelWorker
+
+T = TypeVar("T")
+
+
+def next_item(iterator: Iterator[T]) -> tuple[bool, T | None]:
+    """One step of an iterator as ``(more, item)``."""
+    for item in iterator:
+        return True, item
+
+    return False, None
+
+
+class Emitter:
+    """The ``emit`` callback handed to streaming jobs.
+
+    Items are forwarded to a queue on the event loop. Once ``cancel`` is set,
+    calling it raises JobCancelled in the job instead.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        queue: asyncio.Queue,
+        cancel: CancellationToken,
+    ):
+        self.loop = loop
+        self.queue = queue
+        self.cancel = cancel
+
+    def __call__(self, *item):
+        self.cancel.raise_if_cancelled()
+        self.put(item)
+
+    def put(self, item: tuple):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+
+class Priority(IntEnum):
+    """Lower values are served first."""
+
+    INTERACTIVE = 0
+    SWEEP = 1
+
+
+class WaitStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, wait: float):
+        self.count += 1
+        self.total += wait
+        self.max = max(self.max, wait)
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_wait": self.total / self.count if self.count else 0.0,
+            "max_wait": self.max,
+        }
+
+
+class ModelQueue:
+    """Priority queue of jobs waiting on a single model.
+
+    At most ``concurrency`` jobs hold a slot at once. A finished job hands
+    its slot straight to the highest priority waiter, FIFO within a priority.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.running = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._waits = {priority: WaitStats() for priority in Priority}
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority):
+        start = time.perf_counter()
+
+        if self.running < self.concurrency and not self._waiters:
+            self.running += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._seq), waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # The slot was handed over just as we were cancelled, pass it on
+                if waiter.done() and not waiter.cancelled():
+                    self._release()
+                raise
+
+        self._waits[priority].record(time.perf_counter() - start)
+
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self.running -= 1
+
+    def stats(self) -> dict:
+        queued = {priority.name.lower(): 0 for priority in Priority}
+        for priority, _, waiter in self._waiters:
+            if not waiter.done():
+                queued[Priority(priority).name.lower()] += 1
+
+        return {
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "queued": queued,
+            "waits": {
+                priority.name.lower(): stats.to_dict()
+                for priority, stats in self._waits.items()
+            },
+        }
+
+
+class Scheduler:
+    """Per-model job queues. Every trace a route runs goes through here.
+
+    Jobs run on a dedicated thread pool rather than the event loop's default
+    one, so model work can't starve request handling and other blocking
+    calls of threads. By default the pool has one thread per model slot.
+
+    Models with an entry in ``workers`` are owned by a separate process
+    instead, and their jobs are sent there.
+    """
+
+    def __init__(
+        self,
+        concurrency: dict[str, int],
+        max_workers: int | None = None,
+        workers: dict[str, "ModelWorker"] | None = None,
+    ):
+        self.queues = {
+            model_name: ModelQueue(limit) for model_name, limit in concurrency.items()
+        }
+        self.workers = workers or {}
+        self.max_workers = max_workers or max(sum(concurrency.values()), 1)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="model"
+        )
+
+    def _submit(self, model_name: str, fn: Callable[..., T], *args) -> Future:
+        worker = self.workers.get(model_name)
+        if worker is not None:
+            return worker.submit(fn, *args)
+
+        return self.executor.submit(fn, *args)
+
+    @staticmethod
+    async def _wait(future: Future):
+        """Wait on a job's future.
+
+        A running job can't be interrupted, so if the caller is cancelled
+        this still waits for it to finish before giving up the model's slot.
+        """
+        future = asyncio.wrap_future(future)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait([future])
+            # The caller is gone, don't report the job's own error as unhandled
+            if not future.cancelled():
+                future.exception()
+            raise
+
+    async def run(
+        self,
+        model_name: str,
+        fn: Callable[..., T],
+        *args,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> T:
+        """Wait for a slot on the model, then run ``fn(*args)`` on the executor
+        or the model's worker process."""
+        async with self.queues[model_name].slot(priority):
+            return await self._wait(self._submit(model_name, fn, *args))
+
+    async def iterate(
+        self,
+        model_name: str,
+        fn: Callable[..., Iterator[T]],
+        *args,
+        priority: Priority = Priority.SWEEP,
+    ) -> AsyncIterator[T]:
+        """Pull the iterator returned by ``fn(*args)`` one step at a time,
+        taking a fresh slot per step.
+
+        Interactive jobs queued in the meantime get to run between steps.
+        """
+        worker = self.workers.get(model_name)
+
+        if worker is not None:
+            handle = worker.open(fn, *args)
+            step = lambda: worker.step(handle)
+        else:
+            iterator = fn(*args)
+            step = lambda: self.executor.submit(next_item, iterator)
+
+        try:
+            while True:
+                async with self.queues[model_name].slot(priority):
+                    more, item = await self._wait(step())
+
+                if not more:
+                    return
+
+                yield item
+        finally:
+            if worker is not None:
+                worker.close(handle)
+
+    async def stream(
+        self,
+        model_name: str,
+        fn: Callable[..., object],
+        *args,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> AsyncIterator[tuple]:
+        """Run ``fn(*args, emit)`` like ``run``, yielding each tuple of
+        arguments it passes to ``emit`` while it is still running.
+
+        If the consumer stops early, the next ``emit`` raises JobCancelled
+        inside ``fn`` so the job stops too. A job still waiting for a slot is
+        dropped from the queue without running.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        cancel = CancellationToken()
+        emit = Emitter(asyncio.get_running_loop(), queue, cancel)
+        done = object()
+
+        task = asyncio.create_task(
+            self.run(model_name, fn, *args, emit, priority=priority)
+        )
+        task.add_done_callback(lambda _: queue.put_nowait(done))
+
+        try:
+            while (item := await queue.get()) is not done:
+                yield item
+
+            # Surface errors raised by the job
+            await task
+        finally:
+            if not task.done():
+                cancel.cancel()
+                # Leaves the model's queue if still waiting for a slot. A
+                # running job still holds its slot until it stops
+                task.cancel()
+                # Retrieve the JobCancelled so it isn't reported as unhandled
+                task.add_done_callback(
+                    lambda task: task.cancelled() or task.exception()
+                )
+
+    def stats(self) -> dict:
+        return {
+            "executor": {
+                "max_workers": self.max_workers,
+                "running": sum(queue.running for queue in self.queues.values()),
+            },
+            "models": {
+                model_name: queue.stats() for model_name, queue in self.queues.items()
+            },
+            "workers": {
+                model_name: worker.stats()
+                for model_name, worker in self.workers.items()
+            },
+        }
@@ -1,5 +1,6 @@
 import logging
 import os
+from operator import attrgetter
 import torch
 import toml
 from fastapi import Request
@@ -8,6 +9,13 @@ from nnsight import LanguageModel, CONFIG
 from nnsight.intervention.backends.remote import RemoteBackend
 from pydantic import BaseModel
 
+from .batching import MicroBatcher
+from .cache import ResultCache
+from .prefix_cache import PrefixCache, make_prefix_cache
+from .scheduler import Scheduler
+from .tokens import TokenTable
+from .workers import ModelWorker
+
 # Set up logger for this module
 logger = logging.getLogger(__name__)
 
@@ -18,6 +26,8 @@ class ModelConfig(BaseModel):
     chat: bool
     rename: dict[str, str]
     config: dict[str, int | str]
+    # Max jobs running on the model at once, defaults to MODEL_CONCURRENCY
+    concurrency: int | None = None
 
 class ModelsConfig(BaseModel):
     """Root configuration containing all models."""
@@ -37,6 +47,31 @@ class ModelsConfig(BaseModel):
             for model in self.models.values()
         ]
 
+def load_config() -> ModelsConfig:
+    env = os.environ.get("ENVIRONMENT", "dev")
+    logger.info(f'Loading "{env}" config')
+
+    current_path = os.path.dirname(os.path.abspath(__file__))
+    config_path = os.path.join(current_path, f"_model_configs/{env}.toml")
+    print(config_path)
+
+    with open(config_path, "r") as f:
+        return ModelsConfig(**toml.load(f))
+
+
+def load_model(cfg: ModelConfig, dispatch: bool) -> LanguageModel:
+    model = LanguageModel(
+        cfg.name,
+        rename=cfg.rename,
+        device_map="auto",
+        torch_dtype=torch.bfloat16,
+        dispatch=dispatch,
+    )
+
+    model.config.update(cfg.config)
+    return model
+
+
 class AppState:
     def __init__(self):
         
@@ -44,12 +79,72 @@ class AppState:
 
         # Defaults
         self.models: dict[str, LanguageModel] = {}
+        self.token_tables: dict[str, TokenTable] = {}
+
+        # "thread" runs local models in this process, "process" gives each
+        # model its own worker process
+        self.use_workers = os.environ.get("MODEL_WORKERS", "thread") == "process"
 
         self.config = self._load()
 
+        # Local models run one job at a time, remote jobs only submit to NDIF
+        default_concurrency = int(
+            os.environ.get("MODEL_CONCURRENCY", "16" if self.remote else "1")
+        )
+        concurrency = {
+            cfg.name: cfg.concurrency or default_concurrency
+            for cfg in self.config.models.values()
+        }
+
+        workers = None
+        if self.use_workers:
+            workers = {
+                cfg.name: ModelWorker(cfg, self, concurrency[cfg.name])
+                for cfg in self.config.models.values()
+            }
+
+        self.scheduler = Scheduler(
+            concurrency,
+            # Threads running model jobs, defaults to one per model slot
+            max_workers=int(os.environ.get("MODEL_EXECUTOR_WORKERS", "0")) or None,
+            workers=workers,
+        )
+
+        # Concurrent local requests sharing one padded forward pass
+        self.batcher = MicroBatcher(self.scheduler)
+
+        # Finished patch grids keyed on the full request
+        self.patch_cache = ResultCache(
+            max_entries=int(os.environ.get("PATCH_CACHE_SIZE", "256")),
+            directory=os.environ.get("PATCH_CACHE_DIR"),
+            # Files kept in PATCH_CACHE_DIR
+            max_disk_entries=int(os.environ.get("PATCH_CACHE_DISK_SIZE", "4096")),
+        )
+
+        # KV caches of recent prompts for models traced in this process
+        self.prefix_caches: dict[str, PrefixCache | None] = {
+            model_name: (
+                None if self.remote or self.use_workers else make_prefix_cache(model)
+            )
+            for model_name, model in self.models.items()
+        }
+
+        # Per-prompt lens summaries shared by line, grid and prediction
+        self.lens_cache = ResultCache(
+            max_entries=int(os.environ.get("LENS_CACHE_SIZE", "1024")),
+            max_bytes=int(os.environ.get("LENS_CACHE_BYTES", str(512 * 2**20))),
+            sizeof=attrgetter("nbytes"),
+        )
+
     def get_model(self, model_name: str):
         return self.models[model_name]
 
+    def get_tokens(self, model_name: str) -> TokenTable:
+        return self.token_tables[model_name]
+
+    def get_prefix_cache(self, model_name: str) -> PrefixCache | None:
+        return self.prefix_caches.get(model_name)
+
     def get_config(self):
         return self.config
     
@@ -87,29 +182,20 @@ class AppState:
         return remote
 
     def _load(self):
-        env = os.environ.get("ENVIRONMENT", "dev")
-        logger.info(f'Loading "{env}" config')
-        
-        current_path = os.path.dirname(os.path.abspath(__file__))
-        config_path = os.path.join(current_path, f"_model_configs/{env}.toml")
-        print(config_path)
-
-        with open(config_path, "r") as f:
-            config = ModelsConfig(**toml.load(f))
-
+        config = load_config()
         self.remote = config.remote
 
-        for _, cfg in config.models.items():
-            model = LanguageModel(
-                cfg.name,
-                rename=cfg.rename,
-                device_map="auto",
-                torch_dtype=torch.bfloat16,
-                dispatch=not self.remote,
-            )
+        if self.remote and self.use_workers:
+            logger.info("Remote models are traced on NDIF, not using worker processes")
+            self.use_workers = False
+
+        for cfg in config.models.values():
+            # Models owned by worker processes are only loaded for their
+            # tokenizer and config here
+            model = load_model(cfg, dispatch=not (self.remote or self.use_workers))
 
-            model.config.update(cfg.config)
             self.models[cfg.name] = model
+            self.token_tables[cfg.name] = TokenTable(model.tokenizer, model.lm_head.out_features)
 
         return config
 
@@ -16,6 +16,7 @@ class RequestStatus(Enum):
     READY = "READY"
     COMPLETE = "COMPLETE"
     ERROR = "ERROR"
+    CANCELLED = "CANCELLED"
 
 
 class TelemetryClient:
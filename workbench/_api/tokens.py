@@ -0,0 +1,33 @@
+from typing import Iterable
+
+import numpy as np
+import torch as t
+
+
+class TokenTable:
+    """Decoded string of every vocabulary id, built once per model.
+
+    Lookups index a numpy array instead of calling the tokenizer, and match
+    ``tokenizer.decode([id])`` for each id. ``vocab_size`` is the model's
+    output size, which is often padded past the tokenizer. Those extra ids
+    decode to "" like they do through the tokenizer.
+    """
+
+    def __init__(self, tokenizer, vocab_size: int | None = None):
+        strs = tokenizer.batch_decode([[id] for id in range(len(tokenizer))])
+
+        self.strs = np.full(max(len(strs), vocab_size or 0), "", dtype=object)
+        self.strs[: len(strs)] = strs
+
+    def __len__(self) -> int:
+        return len(self.strs)
+
+    def __getitem__(self, id: int) -> str:
+        return self.strs[id]
+
+    def decode(self, ids: t.Tensor | Iterable[int]) -> list[str]:
+        """Strings of a sequence of ids, one per id."""
+        if isinstance(ids, t.Tensor):
+            ids = ids.cpu().numpy()
+
+        return self.strs[np.asarray(ids, dtype=np.int64)].tolist()
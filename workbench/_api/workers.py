@@ -0,0 +1,372 @@
+"""Model worker processes.
+
+With ``MODEL_WORKERS=process`` every local model is owned by its own worker
+process instead of the API process. The scheduler sends a worker compact
+job descriptions: the job function, pickled by reference, and its
+arguments. Tensors in results come back through shared memory rather than
+being pickled by value.
+
+Jobs take the same ``state`` argument as in the API process. It stands in
+for a ``WorkerState`` holding only the worker's model. Cancellation tokens
+and stream callbacks passed to a job are mirrored in the worker, so
+cancelling in the API still stops the job there.
+
+If a worker dies, its pending jobs fail with WorkerCrashed and it is
+started again.
+"""
+
+import itertools
+import logging
+import pickle
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import Enum
+from functools import partial
+from multiprocessing.reduction import ForkingPickler
+from typing import TYPE_CHECKING, Callable, Iterator
+
+import torch as t
+import torch.multiprocessing as mp
+from fastapi import HTTPException
+
+from .cancellation import CancellationToken
+from .prefix_cache import PrefixCache, make_prefix_cache
+from .scheduler import Emitter, next_item
+from .tokens import TokenTable
+
+if TYPE_CHECKING:
+    from .state import ModelConfig
+
+logger = logging.getLogger(__name__)
+
+# How often the API checks a silent worker is still alive, in seconds
+WORKER_POLL_INTERVAL = 1.0
+
+
+class WorkerCrashed(Exception):
+    """A job's worker process exited before the job finished."""
+
+
+class Arg(Enum):
+    """Placeholders for job arguments that only exist in the API process."""
+
+    STATE = "state"
+    CANCEL = "cancel"
+    EMIT = "emit"
+
+
+class WorkerState:
+    """The parts of AppState jobs use, for the one model a worker owns."""
+
+    remote = False
+
+    def __init__(self, model_name: str, model):
+        self.models = {model_name: model}
+        self.token_tables = {model_name: TokenTable(model.tokenizer, model.lm_head.out_features)}
+        self.prefix_caches = {model_name: make_prefix_cache(model)}
+
+    def get_model(self, model_name: str):
+        return self.models[model_name]
+
+    def get_tokens(self, model_name: str) -> TokenTable:
+        return self.token_tables[model_name]
+
+    def get_prefix_cache(self, model_name: str) -> PrefixCache | None:
+        return self.prefix_caches[model_name]
+
+    def make_backend(self, model=None, job_id=None):
+        return None
+
+    def __getitem__(self, model_name: str):
+        return self.get_model(model_name)
+
+
+def to_cpu(value):
+    """Move every tensor in a result to the CPU so it can go through shared memory."""
+    if isinstance(value, t.Tensor):
+        return value.detach().cpu()
+    if isinstance(value, tuple):
+        items = [to_cpu(item) for item in value]
+        return type(value)(*items) if hasattr(value, "_fields") else tuple(items)
+    if isinstance(value, list):
+        return [to_cpu(item) for item in value]
+    if isinstance(value, dict):
+        return {key: to_cpu(item) for key, item in value.items()}
+    return value
+
+
+def portable(exc: Exception) -> Exception:
+    """The exception itself if it survives pickling, else a RuntimeError describing it."""
+    try:
+        pickle.loads(pickle.dumps(exc))
+        return exc
+    except Exception:
+        return RuntimeError(f"{type(exc).__name__}: {exc}")
+
+
+def worker_main(cfg: "ModelConfig", concurrency: int, inbox, outbox):
+    from .state import load_model
+
+    mp.set_sharing_strategy("file_system")
+
+    state = WorkerState(cfg.name, load_model(cfg, dispatch=True))
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="model")
+    tokens: dict[int, CancellationToken] = {}
+    iterators: dict[int, Iterator] = {}
+
+    def send(kind: str, job_id: int, payload):
+        # Pickled here rather than in the queue's feeder thread, where a
+        # failure would silently drop the reply
+        try:
+            message = ForkingPickler.dumps((kind, job_id, payload))
+        except Exception as e:
+            message = ForkingPickler.dumps(("error", job_id, portable(e)))
+
+        outbox.put(bytes(message))
+
+    def decode(job_id: int, args: list) -> list:
+        def emit(*item):
+            tokens[job_id].raise_if_cancelled()
+            send("emit", job_id, to_cpu(item))
+
+        if Arg.CANCEL in args or Arg.EMIT in args:
+            tokens[job_id] = CancellationToken()
+
+        replacements = {
+            Arg.STATE: lambda: state,
+            Arg.CANCEL: lambda: tokens[job_id],
+            Arg.EMIT: lambda: emit,
+        }
+        return [
+            replacements[arg]() if isinstance(arg, Arg) else arg for arg in args
+        ]
+
+    def run(request_id: int, fn: Callable, *args):
+        try:
+            send("result", request_id, to_cpu(fn(*args)))
+        except HTTPException as e:
+            # Not every starlette version's HTTPException survives pickling,
+            # so it is rebuilt in the API process to keep its status code
+            send("http_error", request_id, (e.status_code, e.detail, e.headers))
+        except Exception as e:
+            send("error", request_id, portable(e))
+
+    def iterate(fn: Callable, args: list):
+        yield from fn(*args)
+
+    send("ready", None, None)
+
+    while True:
+        kind, job_id, payload = inbox.get()
+
+        if kind == "run":
+            fn, args = payload
+            executor.submit(run, job_id, fn, *decode(job_id, args)).add_done_callback(
+                lambda _, job_id=job_id: tokens.pop(job_id, None)
+            )
+
+        elif kind == "open":
+            fn, args = payload
+            iterators[job_id] = iterate(fn, decode(job_id, args))
+
+        elif kind == "next":
+            iterator = iterators.get(payload)
+            if iterator is None:
+                send("error", job_id, KeyError(f"No open job {payload}"))
+            else:
+                executor.submit(run, job_id, next_item, iterator)
+
+        elif kind == "close":
+            tokens.pop(job_id, None)
+            iterator = iterators.pop(job_id, None)
+            if iterator is not None:
+                executor.submit(iterator.close)
+
+        elif kind == "cancel":
+            token = tokens.get(job_id)
+            if token is not None:
+                token.cancel()
+
+
+class ModelWorker:
+    """API side handle on the worker process that owns one model."""
+
+    def __init__(self, cfg: "ModelConfig", state, concurrency: int):
+        self.cfg = cfg
+        self.concurrency = concurrency
+        self.restarts = 0
+
+        # Jobs pass the API's state, the worker swaps in its own
+        self._state = state
+        self._ids = itertools.count()
+        self._lock = threading.RLock()
+        self._futures: dict[int, Future] = {}
+        self._emitters: dict[int, Emitter] = {}
+
+        self._start()
+
+    def _start(self):
+        mp.set_sharing_strategy("file_system")
+        ctx = mp.get_context("spawn")
+
+        self.ready = False
+        self._inbox = ctx.Queue()
+        outbox = ctx.Queue()
+
+        self.process = ctx.Process(
+            target=worker_main,
+            args=(self.cfg, self.concurrency, self._inbox, outbox),
+            name=f"model-worker:{self.cfg.name}",
+            daemon=True,
+        )
+        self.process.start()
+
+        threading.Thread(
+            target=self._read, args=(self.process, outbox), daemon=True
+        ).start()
+
+    def _read(self, process, outbox):
+        while True:
+            try:
+                message = outbox.get(timeout=WORKER_POLL_INTERVAL)
+            except queue.Empty:
+                if process.is_alive():
+                    continue
+
+                self._crashed(process)
+                return
+
+            kind, job_id, payload = ForkingPickler.loads(message)
+
+            if kind == "ready":
+                self.ready = True
+                logger.info(f"Worker for {self.cfg.name} ready, pid {process.pid}")
+                continue
+
+            if kind == "emit":
+                emitter = self._emitters.get(job_id)
+                if emitter is not None:
+                    emitter.put(payload)
+                continue
+
+            with self._lock:
+                future = self._futures.pop(job_id, None)
+                self._emitters.pop(job_id, None)
+
+            if future is None:
+                continue
+
+            if kind == "result":
+                future.set_result(payload)
+            elif kind == "http_error":
+                status_code, detail, headers = payload
+                future.set_exception(HTTPException(status_code, detail, headers))
+            else:
+                future.set_exception(payload)
+
+    def _crashed(self, process):
+        with self._lock:
+            futures, self._futures = self._futures, {}
+            self._emitters = {}
+
+            logger.error(
+                f"Worker for {self.cfg.name} exited with code {process.exitcode}, "
+                f"failing {len(futures)} jobs"
+            )
+
+            # A worker that never finished loading its model would only crash again
+            if self.ready:
+                self.restarts += 1
+                self._start()
+            else:
+                logger.error(f"Worker for {self.cfg.name} failed to start")
+
+        for future in futures.values():
+            future.set_exception(
+                WorkerCrashed(f"Worker for {self.cfg.name} exited mid-job")
+            )
+
+    def _send(self, kind: str, job_id: int, payload=None):
+        self._inbox.put((kind, job_id, payload))
+
+    def _send_job(self, kind: str, job_id: int, fn: Callable, args: tuple):
+        encoded = []
+        tokens = []
+
+        for arg in args:
+            if arg is self._state:
+                arg = Arg.STATE
+            elif isinstance(arg, Emitter):
+                self._emitters[job_id] = arg
+                tokens.append(arg.cancel)
+                arg = Arg.EMIT
+            elif isinstance(arg, CancellationToken):
+                tokens.append(arg)
+                arg = Arg.CANCEL
+
+            encoded.append(arg)
+
+        self._send(kind, job_id, (fn, encoded))
+
+        # Registered after the job is sent so a cancel never arrives first
+        for token in tokens:
+            token.on_cancel(partial(self._send, "cancel", job_id))
+
+    def _expect(self, request_id: int) -> Future:
+        """Future for a request's reply. Call with the lock held so a restart
+        can't happen between registering it and sending the request."""
+        future = Future()
+
+        if self.process.is_alive():
+            self._futures[request_id] = future
+        else:
+            future.set_exception(
+                WorkerCrashed(f"Worker for {self.cfg.name} is not running")
+            )
+
+        return future
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Run ``fn(*args)`` in the worker."""
+        job_id = next(self._ids)
+
+        with self._lock:
+            future = self._expect(job_id)
+            if not future.done():
+                self._send_job("run", job_id, fn, args)
+
+        return future
+
+    def open(self, fn: Callable[..., Iterator], *args) -> int:
+        """Create the iterator ``fn(*args)`` in the worker, returning its handle."""
+        handle = next(self._ids)
+
+        with self._lock:
+            self._send_job("open", handle, fn, args)
+
+        return handle
+
+    def step(self, handle: int) -> Future:
+        """Advance an open iterator, resolving to ``(more, item)``."""
+        request_id = next(self._ids)
+
+        with self._lock:
+            future = self._expect(request_id)
+            if not future.done():
+                self._send("next", request_id, handle)
+
+        return future
+
+    def close(self, handle: int):
+        self._emitters.pop(handle, None)
+        self._send("close", handle)
+
+    def stats(self) -> dict:
+        return {
+            "pid": self.process.pid,
+            "alive": self.process.is_alive(),
+            "ready": self.ready,
+            "restarts": self.restarts,
+            "pending": len(self._futures),
+        }
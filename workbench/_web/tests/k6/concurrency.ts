@@ -0,0 +1,91 @@
+import http from 'k6/http';
+import { check } from 'k6';
+import { Options } from 'k6/options';
+import { Trend } from 'k6/metrics';
+import exec from 'k6/execution';
+import { startAndPoll, config } from './utils.ts';
+
+// Light requests issued while heavy grid jobs keep the model busy. None of
+// them need the model, so their latency should stay flat no matter how many
+// grids are queued.
+const heavyDuration = new Trend('heavy_grid_duration', true);
+const lightModelsDuration = new Trend('light_models_duration', true);
+const lightCachedPredictionDuration = new Trend('light_cached_prediction_duration', true);
+
+const MODEL = __ENV.MODEL || 'openai-community/gpt2';
+
+export const options: Options = {
+    scenarios: {
+        heavy: {
+            executor: 'constant-vus',
+            exec: 'heavyGrid',
+            vus: Number(__ENV.HEAVY_VUS || 4),
+            duration: '30s',
+        },
+        light: {
+            executor: 'constant-arrival-rate',
+            exec: 'lightRequests',
+            rate: 10,
+            timeUnit: '1s',
+            duration: '30s',
+            preAllocatedVUs: 10,
+            // Let the heavy jobs fill the queue first
+            startTime: '2s',
+        },
+    },
+    thresholds: {
+        http_req_failed: ['rate<0.01'],
+        light_models_duration: ['p(95)<200'],
+        light_cached_prediction_duration: ['p(95)<200'],
+    },
+};
+
+// Long enough that each grid takes a while to trace
+const heavyPrompt = Array(64).fill('The quick brown fox jumps over the lazy dog.').join(' ');
+
+const cachedPrompt = 'The quick brown fox jumps over the lazy dog';
+
+// Served from the prompt's lens summary for any token, since the default
+// topK fits in the summary's final layer candidates. A line lens only skips
+// the model when its target is in the cached top-k at every layer.
+const cachedPrediction = {
+    model: MODEL,
+    prompt: cachedPrompt,
+    token: { idx: 3, id: 0, text: 'fox', targetIds: [] },
+};
+
+export function setup() {
+    // Only a full-window grid writes the lens summary
+    startAndPoll(
+        config.endpoints.startLensGrid,
+        { model: MODEL, prompt: cachedPrompt },
+        config.endpoints.resultsLensGrid,
+    );
+}
+
+export function heavyGrid() {
+    // A fresh prompt every iteration so the lens cache can't serve it
+    const body = {
+        model: MODEL,
+        prompt: `${exec.scenario.iterationInTest} ${heavyPrompt}`,
+    };
+
+    const result = startAndPoll(config.endpoints.startLensGrid, body, config.endpoints.resultsLensGrid);
+    heavyDuration.add(result.pollDuration);
+}
+
+export function lightRequests() {
+    const models = http.get(config.getApiUrl(config.endpoints.models), {
+        headers: config.headers,
+    });
+    lightModelsDuration.add(models.timings.duration);
+    check(models, { 'models status is 200': (r) => r.status === 200 });
+
+    const prediction = http.post(
+        config.getApiUrl(config.endpoints.startPrediction),
+        JSON.stringify(cachedPrediction),
+        { headers: config.headers },
+    );
+    lightCachedPredictionDuration.add(prediction.timings.duration);
+    check(prediction, { 'cached prediction status is 200': (r) => r.status === 200 });
+}
@@ -6,10 +6,16 @@ const POLL_INTERVAL_MS = 1000;
 
 const config = {
     backendUrl: __ENV.BACKEND_URL || 'http://localhost:8000',
+    headers: {
+        'Content-Type': 'application/json',
+        'X-User-Email': __ENV.USER_EMAIL || 'k6@workbench.local',
+    },
     endpoints: {
         startLensLine: '/lens/start-line',
         resultsLensLine: (jobId: string) => `/lens/results-line/${jobId}`,
         startLensGrid: '/lens/start-grid',
+        models: '/models/',
+        startPrediction: '/models/start-prediction',
         resultsLensGrid: (jobId: string) => `/lens/results-grid/${jobId}`,
     },
     getApiUrl: (endpoint: string) => `${config.backendUrl}${endpoint}`,
@@ -54,7 +60,7 @@ function awaitNDIFJob(jobId: string): void {
 
 function startJob<T>(url: string, body: any): JobStartResponse<T> {
     const response = http.post(url, JSON.stringify(body), {
-        headers: { 'Content-Type': 'application/json' },
+        headers: config.headers,
     });
     
     if (response.status !== 200) {
@@ -66,7 +72,7 @@ function startJob<T>(url: string, body: any): JobStartResponse<T> {
 
 function fetchResults<T>(url: string, body: any): T {
     const resp = http.post(url, JSON.stringify(body), {
-        headers: { 'Content-Type': 'application/json' },
+        headers: config.headers,
     });
     
     if (resp.status !== 200) {